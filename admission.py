@@ -0,0 +1,305 @@
+import math
+import hashlib
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from fastapi import HTTPException
+from config import settings, logger
+from usage import ledger
+
+
+class TokenBucket:
+    """
+    Characters-per-second budget. A request larger than the burst is admitted once the bucket
+    is full and leaves it in debt, so large requests are slowed down rather than refused.
+    """
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount, max_wait):
+        """
+        Take amount tokens and return the seconds to wait before using them,
+        or None (taking nothing) if that wait would exceed max_wait.
+        """
+        if self.rate <= 0:
+            return 0.0
+        self._refill(time.monotonic())
+        wait = max(0.0, (min(amount, self.burst) - self.tokens) / self.rate)
+        if wait > max_wait:
+            return None
+        self.tokens -= amount
+        return wait
+
+    def refund(self, amount):
+        self.tokens = min(self.burst, self.tokens + amount)
+
+
+class ClientState:
+    def __init__(self, name, characters_per_second, burst_characters, max_concurrent):
+        self.name = name
+        self.bucket = TokenBucket(characters_per_second, burst_characters)
+        self.max_concurrent = int(max_concurrent)
+        self.active = 0
+        self.queued = 0
+
+    def stats(self):
+        return {
+            "active_sessions": self.active,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            "characters_per_second": self.bucket.rate,
+            "available_characters": round(self.bucket.tokens, 1),
+        }
+
+
+class Ticket:
+    """
+    One admitted request. release() frees its session slots and books its usage; it is idempotent.
+    """
+    def __init__(self, scheduler, client, model, cost, sessions, timeline):
+        self.scheduler = scheduler
+        self.client = client
+        self.model = model
+        self.cost = cost
+        self.sessions = sessions
+        self.timeline = timeline
+        self.granted = False
+        self.cancelled = False
+        self.released = False
+        self.future = None
+        self.loop = None
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        if self.scheduler:
+            self.scheduler.release(self)
+        if ledger:
+            counters = self.timeline.counters if self.timeline else {}
+            ledger.record(
+                self.client.name, self.model, requests=1,
+                errors=int(self.timeline is not None and self.timeline.status != "ok"),
+                characters=counters.get("usage_characters", 0),
+                saved_characters=counters.get("saved_characters", 0),
+            )
+
+    def wrap(self, iterator):
+        """
+        Release once a streamed response has been fully produced or closed.
+        """
+        try:
+            yield from iterator
+        finally:
+            self.release()
+
+
+class AdmissionScheduler:
+    """
+    Grants upstream session slots shortest-job-first: waiting requests are ordered by estimated cost
+    (characters) plus an aging term, so short interactive requests overtake long ones but long ones
+    still move up the queue the longer they wait. Per-client concurrency limits are enforced on grant.
+    """
+    def __init__(self, max_sessions, aging_characters_per_second):
+        self.max_sessions = max_sessions
+        self.aging = aging_characters_per_second
+        self.active = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    async def acquire(self, ticket, timeout):
+        ticket.loop = asyncio.get_running_loop()
+        ticket.future = ticket.loop.create_future()
+        with self._lock:
+            # Earlier arrival lowers the priority value at the aging rate; the order of waiting requests never changes
+            priority = ticket.cost + time.monotonic() * self.aging
+            heapq.heappush(self._waiting, (priority, next(self._sequence), ticket))
+            ticket.client.queued += 1
+            self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if not ticket.granted:
+                    ticket.cancelled = True
+                    ticket.client.queued -= 1
+                    return False
+        except asyncio.CancelledError:
+            # The waiter is gone (client disconnect, shutdown): drop the ticket or free the slots it was granted
+            with self._lock:
+                if not ticket.granted:
+                    ticket.cancelled = True
+                    ticket.client.queued -= 1
+            ticket.released = True
+            self.release(ticket)
+            raise
+        return True
+
+    def release(self, ticket):
+        with self._lock:
+            if not ticket.granted:
+                return
+            self.active -= ticket.sessions
+            ticket.client.active -= ticket.sessions
+            self._dispatch()
+
+    def _dispatch(self):
+        skipped = []
+        while self._waiting:
+            ticket = self._waiting[0][2]
+            if ticket.cancelled:
+                heapq.heappop(self._waiting)
+                continue
+            # A request needing more slots than exist may still run alone
+            if self.active and self.active + ticket.sessions > self.max_sessions:
+                break
+            entry = heapq.heappop(self._waiting)
+            client = ticket.client
+            if client.active and client.active + ticket.sessions > client.max_concurrent:
+                skipped.append(entry)
+                continue
+            ticket.granted = True
+            self.active += ticket.sessions
+            client.active += ticket.sessions
+            client.queued -= 1
+            ticket.loop.call_soon_threadsafe(_resolve, ticket.future)
+        for entry in skipped:
+            heapq.heappush(self._waiting, entry)
+
+    def stats(self, clients):
+        with self._lock:
+            return {
+                "active_sessions": self.active,
+                "max_sessions": self.max_sessions,
+                "queued": sum(1 for _, _, ticket in self._waiting if not ticket.cancelled),
+                "clients": {name: client.stats() for name, client in clients.items()},
+            }
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+def _limits(entry):
+    defaults = settings.get("admission.defaultLimits", None) or {}
+    return (
+        float(entry.get("charactersPerSecond", defaults.get("charactersPerSecond", 0))),
+        float(entry.get("burstCharacters", defaults.get("burstCharacters", 5000))),
+        int(entry.get("maxConcurrent", defaults.get("maxConcurrent", 4))),
+    )
+
+
+ADMISSION_ENABLED = settings.get("admission.enabled", False)
+if isinstance(ADMISSION_ENABLED, str):
+    ADMISSION_ENABLED = ADMISSION_ENABLED.lower() == "true"
+REQUIRE_API_KEY = settings.get("admission.requireApiKey", False)
+if isinstance(REQUIRE_API_KEY, str):
+    REQUIRE_API_KEY = REQUIRE_API_KEY.lower() == "true"
+CLIENT_HEADER = settings.get("admission.clientHeader", "X-Client-Id")
+MAX_QUEUE_SECONDS = float(settings.get("admission.maxQueueSeconds", 30))
+
+scheduler = AdmissionScheduler(
+    int(settings.get("admission.maxSessions", 16)),
+    float(settings.get("admission.agingCharactersPerSecond", 100)),
+)
+
+API_KEYS = {entry["key"]: entry for entry in settings.get("admission.clients", None) or []}
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def identify_client(http_request):
+    """
+    Client name from an API key (X-API-Key or Authorization: Bearer) or the client header.
+    """
+    api_key = http_request.headers.get("x-api-key")
+    authorization = http_request.headers.get("authorization", "")
+    if not api_key and authorization.lower().startswith("bearer "):
+        api_key = authorization[len("bearer "):].strip()
+    if api_key:
+        entry = API_KEYS.get(api_key)
+        if entry is None:
+            raise HTTPException(status_code=401, detail="Unknown API key")
+        # Unnamed keys get an opaque label; the name shows up in logs, /usage and /debug/requests
+        return entry.get("name") or "key-" + hashlib.sha256(api_key.encode()).hexdigest()[:8], entry
+    if REQUIRE_API_KEY:
+        raise HTTPException(status_code=401, detail="API key required")
+    return http_request.headers.get(CLIENT_HEADER) or "anonymous", {}
+
+
+def get_client(name, entry):
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = ClientState(name, *_limits(entry))
+        return _clients[name]
+
+
+async def admit(http_request, timeline, model, cost, sessions=1):
+    """
+    Identify the client, apply its character budget and wait for session slots.
+    Raises 429 when the budget or the queue wait would exceed admission.maxQueueSeconds.
+    """
+    if not ADMISSION_ENABLED:
+        name = http_request.headers.get(CLIENT_HEADER) or "anonymous"
+        ticket = Ticket(None, ClientState(name, 0, 0, 0), model, cost, sessions, timeline)
+        timeline.client = name
+        return ticket
+    client = get_client(*identify_client(http_request))
+    timeline.client = client.name
+    ticket = Ticket(scheduler, client, model, cost, sessions, timeline)
+    with timeline.span("queue"):
+        wait = client.bucket.reserve(cost, MAX_QUEUE_SECONDS)
+        if wait is None:
+            retry_after = (min(cost, client.bucket.burst) - client.bucket.tokens) / client.bucket.rate
+            _reject(client, model, "Character rate limit exceeded", retry_after)
+        try:
+            if wait:
+                await asyncio.sleep(wait)
+            admitted = await scheduler.acquire(ticket, MAX_QUEUE_SECONDS - wait)
+        except asyncio.CancelledError:
+            client.bucket.refund(cost)
+            raise
+        if not admitted:
+            client.bucket.refund(cost)
+            _reject(client, model, "Too many concurrent sessions", 1)
+    logger.debug(f"Admitted: client={client.name}, cost={cost}, sessions={sessions}")
+    return ticket
+
+
+def _reject(client, model, reason, retry_after):
+    logger.warning(f"Admission rejected: client={client.name}, reason={reason}")
+    if ledger:
+        ledger.record(client.name, model, rejected=1)
+    raise HTTPException(status_code=429, detail=reason, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+def usage_scope(http_request, client=None):
+    """
+    Resolve the client filter for /usage as (client, admin). With admission.requireApiKey a caller
+    only sees its own client unless its key is marked admin: true.
+    """
+    if not (ADMISSION_ENABLED and REQUIRE_API_KEY):
+        return client, True
+    name, entry = identify_client(http_request)
+    if entry.get("admin"):
+        return client, True
+    if client and client != name:
+        raise HTTPException(status_code=403, detail="Usage of other clients requires an admin key")
+    return name, False
+
+
+def admission_stats():
+    with _clients_lock:
+        clients = dict(_clients)
+    return {"enabled": ADMISSION_ENABLED, **scheduler.stats(clients)}
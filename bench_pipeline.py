@@ -0,0 +1,129 @@
+"""
+Microbenchmark of the PCM chunk pipeline against the previous BytesIO/json.dumps handling of audio deltas.
+
+    python bench_pipeline.py --seconds 30 --runs 5
+
+For the /tts path (accumulate and build a WAV) and the SSE path (one event per delta that is sent and dropped,
+accumulate, WAV for saving) it reports the peak memory held per byte of PCM, i.e. how many copies of the audio
+exist at once, and the CPU time per second of audio. The upstream base64 deltas are created before measuring.
+The /tts path is also measured with a ResampleStage for the output sample rates other than 24 kHz, which is
+by far the most expensive stage.
+"""
+import io
+import json
+import time
+import wave
+import base64
+import argparse
+import statistics
+import tracemalloc
+from array import array
+
+from pcm_pipeline import PcmPipeline, AccumulateStage, SseEncodeStage, ResampleStage
+
+SAMPLE_RATE = 24000
+DELTA_MS = 100
+
+
+def make_deltas(seconds):
+    samples = SAMPLE_RATE * DELTA_MS // 1000
+    pcm = array('h', ((i * 37) % 20000 - 10000 for i in range(samples))).tobytes()
+    return [base64.b64encode(pcm).decode() for _ in range(seconds * 1000 // DELTA_MS)], len(pcm)
+
+
+def legacy_wav(pcm_data):
+    wav_buf = io.BytesIO()
+    with wave.open(wav_buf, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(pcm_data)
+    return wav_buf.getvalue()
+
+
+def legacy_tts(deltas):
+    audio = io.BytesIO()
+    for delta in deltas:
+        audio.write(base64.b64decode(delta))
+    return [legacy_wav(audio.getvalue())]
+
+
+def legacy_sse(deltas):
+    audio = io.BytesIO()
+    sent = 0
+    for delta in deltas:
+        sent += len(f"data: {json.dumps({'audio': delta, 'is_end': False})}\n\n")
+        audio.write(base64.b64decode(delta))
+    return [legacy_wav(audio.getvalue())]
+
+
+def pipeline_tts(deltas):
+    accumulator = AccumulateStage()
+    pipeline = PcmPipeline([accumulator])
+    for delta in deltas:
+        pipeline.push_b64(delta)
+    pipeline.close()
+    return [accumulator.wav(SAMPLE_RATE)]
+
+
+def pipeline_sse(deltas):
+    accumulator = AccumulateStage()
+    pipeline = PcmPipeline([SseEncodeStage(), accumulator])
+    sent = 0
+    for delta in deltas:
+        sent += len(pipeline.push_b64(delta).event)
+    pipeline.close()
+    return [accumulator.wav(SAMPLE_RATE)]
+
+
+def pipeline_resample(to_rate):
+    def run(deltas):
+        accumulator = AccumulateStage()
+        pipeline = PcmPipeline([ResampleStage(SAMPLE_RATE, to_rate), accumulator])
+        for delta in deltas:
+            pipeline.push_b64(delta)
+        pipeline.close()
+        return [accumulator.wav(to_rate)]
+    return run
+
+
+def measure(function, deltas, pcm_bytes):
+    tracemalloc.start()
+    start = time.process_time()
+    result = function(deltas)
+    cpu = time.process_time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak / pcm_bytes, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=int, default=30, help="audio length per run")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    deltas, delta_bytes = make_deltas(args.seconds)
+    pcm_bytes = delta_bytes * len(deltas)
+    print(f"{args.seconds} s of audio in {len(deltas)} deltas of {DELTA_MS} ms ({pcm_bytes} bytes PCM)")
+    cases = [
+        ("tts", "legacy", legacy_tts), ("tts", "pipeline", pipeline_tts),
+        ("sse", "legacy", legacy_sse), ("sse", "pipeline", pipeline_sse),
+        ("tts", "->8k", pipeline_resample(8000)), ("tts", "->16k", pipeline_resample(16000)),
+        ("tts", "->48k", pipeline_resample(48000)),
+    ]
+    for name, label, function in cases:
+        # Timed without tracemalloc, which slows down allocations
+        cpu_runs = []
+        for _ in range(args.runs):
+            start = time.process_time()
+            function(deltas)
+            cpu_runs.append(time.process_time() - start)
+        copies, _ = measure(function, deltas, pcm_bytes)
+        cpu_ms = statistics.median(cpu_runs) * 1000 / args.seconds
+        print(f"{name:>4} {label:>9}: {copies:5.2f} x PCM held at peak, {cpu_ms:6.3f} ms CPU per audio second")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Startup benchmark: import time of main, time until /health and /ready answer, and first-request latency.
+
+    python bench_startup.py --runs 5 --port 9998
+
+Offline against fake upstreams (see fake_upstream.py):
+
+    DASHSCOPE__ENDPOINTS='@json [{"url": "ws://127.0.0.1:9101"}]' READINESS__VALIDATEAPIKEY=false \\
+        python bench_startup.py
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+
+ROOT = os.path.dirname(os.path.realpath(__file__))
+
+
+def measure_imports(top):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=ROOT, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        sys.exit(f"import main failed:\n{result.stderr[-2000:]}")
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Only report direct imports of the application modules
+        if len(name) - len(name.lstrip()) <= 3:
+            modules.append((int(cumulative) / 1000, name.strip()))
+    return wall_ms, sorted(modules, reverse=True)[:top]
+
+
+def request(url, data=None, timeout=60):
+    body = json.dumps(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def wait_for(url, deadline):
+    while time.perf_counter() < deadline:
+        if request(url, timeout=1) == 200:
+            return time.perf_counter()
+        time.sleep(0.02)
+    return None
+
+
+def measure_server(port, text, model, timeout):
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                              cwd=ROOT)
+    try:
+        deadline = start + timeout
+        live = wait_for(f"{base}/health", deadline)
+        ready = wait_for(f"{base}/ready", deadline)
+        first_request_ms = None
+        if ready and text:
+            t0 = time.perf_counter()
+            status = request(f"{base}/tts", {"text": text, "model": model}, timeout=timeout)
+            if status == 200:
+                first_request_ms = (time.perf_counter() - t0) * 1000
+            else:
+                print(f"first /tts request failed: HTTP {status}")
+        return {
+            "live_ms": (live - start) * 1000 if live else None,
+            "ready_ms": (ready - start) * 1000 if ready else None,
+            "first_request_ms": first_request_ms,
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=9998)
+    parser.add_argument("--text", default="Hello world.", help="text for the first /tts request, empty to skip")
+    parser.add_argument("--model", default="qwen3-tts-flash-realtime")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    args = parser.parse_args()
+
+    import_runs = [measure_imports(args.top) for _ in range(args.runs)]
+    print(f"import main: median {statistics.median(wall for wall, _ in import_runs):.0f} ms (process start included)")
+    for cumulative_ms, name in import_runs[-1][1]:
+        print(f"  {cumulative_ms:8.1f} ms  {name}")
+
+    server_runs = [measure_server(args.port, args.text, args.model, args.timeout) for _ in range(args.runs)]
+    for key in ("live_ms", "ready_ms", "first_request_ms"):
+        values = [run[key] for run in server_runs if run[key] is not None]
+        summary = f"median {statistics.median(values):.0f} ms, max {max(values):.0f} ms" if values else "n/a"
+        print(f"{key:>17}: {summary} ({len(values)}/{args.runs} runs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+End-to-end latency of /tts_text_stream against /tts_stream for text that is generated word by word, as from an LLM.
+
+    python bench_text_stream.py --url http://localhost:9999 --words-per-second 20
+
+The text is sent as a chunked NDJSON body at the given rate on the same connection that receives the audio.
+For /tts_stream the benchmark waits until the whole text is "generated" and then sends it in one request.
+Both report the time from the first generated word to the first audio event.
+
+Offline against a fake upstream (see fake_upstream.py), with the server started as
+
+    DASHSCOPE__ENDPOINTS='@json [{"url": "ws://127.0.0.1:9101"}]' READINESS__VALIDATEAPIKEY=false python main.py
+"""
+import json
+import time
+import asyncio
+import argparse
+import urllib.parse
+import urllib.request
+
+TEXT = ("Guten Tag und willkommen. Heute sprechen wir über das Wetter in Berlin. Am Vormittag bleibt es trocken, "
+        "am Nachmittag ziehen von Westen Wolken auf. Gegen Abend ist mit leichtem Regen zu rechnen. "
+        "Die Temperaturen erreichen bis zu achtzehn Grad. Morgen wird es wieder sonniger.")
+
+
+async def read_events(reader):
+    """
+    Yield SSE events from a chunked HTTP response.
+    """
+    while (await reader.readline()).strip():
+        pass
+    buffer = b""
+    while True:
+        size = int((await reader.readline()).strip() or b"0", 16)
+        if not size:
+            break
+        buffer += (await reader.readexactly(size + 2))[:-2]
+        *events, buffer = buffer.split(b"\n\n")
+        for event in events:
+            if event.startswith(b"data: "):
+                yield json.loads(event[len(b"data: "):])
+
+
+async def measure_text_stream(url, model, words, rate):
+    parts = urllib.parse.urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    writer.write(f"POST /tts_text_stream HTTP/1.1\r\nHost: {parts.netloc}\r\nContent-Type: application/x-ndjson\r\n"
+                 f"Transfer-Encoding: chunked\r\n\r\n".encode())
+
+    def send(message):
+        line = (json.dumps(message) + "\n").encode()
+        writer.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+
+    async def produce():
+        send({"model": model, "expected_characters": len(TEXT)})
+        for word in words:
+            send({"text": word + " "})
+            await writer.drain()
+            await asyncio.sleep(1 / rate)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    producer = asyncio.create_task(produce())
+    first_audio = None
+    async for event in read_events(reader):
+        if "audio" in event and first_audio is None:
+            first_audio = time.perf_counter() - start
+        if "error" in event:
+            raise RuntimeError(event["error"])
+    generated = await producer
+    writer.close()
+    return generated, first_audio, time.perf_counter() - start
+
+
+def measure_full_text(url, model, words, rate):
+    generated = len(words) / rate
+    time.sleep(generated)
+    request = urllib.request.Request(url.rstrip("/") + "/tts_stream", method="POST",
+                                     data=json.dumps({"text": TEXT, "model": model}).encode(),
+                                     headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    first_audio = None
+    with urllib.request.urlopen(request) as response:
+        for line in response:
+            if line.startswith(b'data: {"audio"') and first_audio is None:
+                first_audio = time.perf_counter() - start
+    return generated, generated + first_audio, generated + time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:9999")
+    parser.add_argument("--model", default="qwen3-tts-flash-realtime")
+    parser.add_argument("--words-per-second", type=float, default=20)
+    args = parser.parse_args()
+
+    words = TEXT.split()
+    print(f"{len(words)} words at {args.words_per_second:g} words/s")
+    results = [
+        ("/tts_text_stream", asyncio.run(measure_text_stream(args.url, args.model, words, args.words_per_second))),
+        ("/tts_stream", measure_full_text(args.url, args.model, words, args.words_per_second)),
+    ]
+    for route, (generated, first_audio, done) in results:
+        print(f"{route:>17}: text done {generated * 1000:6.0f} ms, first audio {first_audio * 1000:6.0f} ms, "
+              f"last audio {done * 1000:6.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,30 @@
-import io
-import base64
 import threading
 import queue
-from dashscope.audio.qwen_tts_realtime import QwenTtsRealtimeCallback
 from config import logger
+from pcm_pipeline import PcmPipeline, AccumulateStage
+from upstream import parse_error_event
 
-class HttpCallback(QwenTtsRealtimeCallback):
-    def __init__(self):
+# The callbacks implement the QwenTtsRealtimeCallback interface (on_open/on_close/on_event)
+# without subclassing it, so importing them does not load the DashScope SDK.
+
+class HttpCallback:
+    def __init__(self, timeline=None, stages=()):
         self.complete_event = threading.Event()
-        self.buffer = io.BytesIO()
+        # Deltas are decoded once and kept as chunks; stages (e.g. resampling) run before accumulation
+        self.accumulator = AccumulateStage()
+        self.pipeline = PcmPipeline(list(stages) + [self.accumulator], timeline)
         self.error_msg = None
         self.usage_characters = 0
+        self.timeline = timeline
+        self.upstream = None
+        self.session = None
 
     def on_open(self) -> None:
         logger.debug("HttpCallback: Connection opened")
 
     def on_close(self, close_status_code, close_msg) -> None:
         logger.debug(f"HttpCallback: Connection closed, code={close_status_code}, msg={close_msg}")
+        self.release_upstream(self.error_msg or "Connection closed before session finished")
         self.complete_event.set()
 
     def on_event(self, response: str) -> None:
@@ -26,18 +34,27 @@ class HttpCallback(QwenTtsRealtimeCallback):
             if 'response.audio.delta' == type:
                 recv_audio_b64 = response.get('delta')
                 if recv_audio_b64:
-                    audio_bytes = base64.b64decode(recv_audio_b64)
-                    self.buffer.write(audio_bytes)
-                    logger.debug(f"HttpCallback: Appended {len(audio_bytes)} bytes to buffer")
+                    if self.upstream:
+                        self.upstream.first_delta()
+                    if self.timeline:
+                        self.timeline.mark('first_delta')
+                    self.pipeline.push_b64(recv_audio_b64)
+                    logger.debug(f"HttpCallback: Accumulated {self.accumulator.size} bytes")
             elif 'response.done' == type:
                 logger.debug('HttpCallback: Done event received')
-                self.usage_characters = response.get('response', {}).get('usage', {}).get('characters', 0)
+                # One response per commit; a session in commit mode has several
+                characters = response.get('response', {}).get('usage', {}).get('characters', 0) or 0
+                self.usage_characters += characters
+                if self.timeline:
+                    self.timeline.count("usage_characters", characters)
             elif 'session.finished' == type:
                 logger.debug("HttpCallback: Session finished")
+                self.release_upstream()
                 self.complete_event.set()
             elif 'error' == type:
-                self.error_msg = response.get('message', 'Unknown error')
+                self.error_msg, request_error = parse_error_event(response)
                 logger.error(f"HttpCallback: Error event received: {self.error_msg}")
+                self.release_upstream(None if request_error else self.error_msg)
                 self.complete_event.set()
         except Exception as e:
             logger.exception(f"HttpCallback: Exception in on_event: {str(e)}")
@@ -47,23 +64,45 @@ class HttpCallback(QwenTtsRealtimeCallback):
     def wait_for_finished(self, timeout=30):
         return self.complete_event.wait(timeout=timeout)
 
-    def get_audio_data(self):
-        return self.buffer.getvalue()
+    def get_audio_wav(self, sample_rate=24000):
+        self.pipeline.close()
+        return self.accumulator.wav(sample_rate)
+
     def get_usage_characters(self):
         return str(self.usage_characters)
 
+    def release_upstream(self, error=None):
+        if self.upstream:
+            self.upstream.release(error)
+
+    def abort(self, error="timeout"):
+        """
+        Give up on a session that stopped responding: count it as an upstream error
+        (a hung probe fails the probe) and close the connection.
+        """
+        self.release_upstream(error)
+        if self.session:
+            try:
+                self.session.close()
+            except Exception as e:
+                logger.debug(f"Closing aborted session failed: {str(e)}")
+
 
-class SSECallback(QwenTtsRealtimeCallback):
-    def __init__(self):
+class SSECallback:
+    def __init__(self, timeline=None):
         self.queue = queue.Queue()
         self.error_msg = None
         self.usage_characters = 0
+        self.timeline = timeline
+        self.upstream = None
+        self.session = None
 
     def on_open(self) -> None:
         logger.debug("SSECallback: Connection opened")
 
     def on_close(self, close_status_code, close_msg) -> None:
         logger.debug(f"SSECallback: Connection closed, code={close_status_code}, msg={close_msg}")
+        self.release_upstream(self.error_msg or "Connection closed before session finished")
         self.queue.put(None)
 
     def on_event(self, response: dict) -> None:
@@ -74,16 +113,26 @@ class SSECallback(QwenTtsRealtimeCallback):
                 audio_delta = response.get('delta')
                 if audio_delta:
                     logger.debug(f"SSECallback: Received audio delta, size={len(audio_delta)}")
+                    if self.upstream:
+                        self.upstream.first_delta()
+                    if self.timeline:
+                        self.timeline.mark('first_delta')
                     self.queue.put({"audio": audio_delta, "is_end": False})
             elif 'response.done' == type:
                 logger.debug('HttpCallback: Done event received')
-                self.usage_characters = response.get('response', {}).get('usage', {}).get('characters', 0)
+                # One response per commit; a session in commit mode has several
+                characters = response.get('response', {}).get('usage', {}).get('characters', 0) or 0
+                self.usage_characters += characters
+                if self.timeline:
+                    self.timeline.count("usage_characters", characters)
             elif 'session.finished' == type:
                 logger.debug("SSECallback: Session finished")
+                self.release_upstream()
                 self.queue.put(None)
             elif 'error' == type:
-                self.error_msg = response.get('message', 'Unknown error')
+                self.error_msg, request_error = parse_error_event(response)
                 logger.error(f"SSECallback: Error event received: {self.error_msg}")
+                self.release_upstream(None if request_error else self.error_msg)
                 self.queue.put({"error": self.error_msg})
                 self.queue.put(None)
         except Exception as e:
@@ -93,4 +142,20 @@ class SSECallback(QwenTtsRealtimeCallback):
             self.queue.put(None)
 
     def get_usage_characters(self):
-        return str(self.usage_characters)
\ No newline at end of file
+        return str(self.usage_characters)
+
+    def release_upstream(self, error=None):
+        if self.upstream:
+            self.upstream.release(error)
+
+    def abort(self, error="timeout"):
+        """
+        Give up on a session that stopped responding: count it as an upstream error
+        (a hung probe fails the probe) and close the connection.
+        """
+        self.release_upstream(error)
+        if self.session:
+            try:
+                self.session.close()
+            except Exception as e:
+                logger.debug(f"Closing aborted session failed: {str(e)}")
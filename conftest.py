@@ -0,0 +1,14 @@
+"""
+Settings for the tests: a dummy API key, no key validation and no output outside a temporary directory.
+Upstreams are fake_upstream.py instances that the tests point the balancer at.
+"""
+import os
+import tempfile
+
+os.environ.update({
+    "DASHSCOPE_API_KEY": "sk-test",
+    "READINESS__VALIDATEAPIKEY": "false",
+    "ENABLESAVE": "false",
+    "OUTPUTDIR": tempfile.mkdtemp(),
+    "TEXTSTREAM__MINCOMMITCHARACTERS": "20",
+})
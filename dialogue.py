@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+from config import settings, logger
+from synthesis import synthesize_pcm
+from segment_cache import SEGMENT_CACHE_ENABLED, SegmentPlan
+
+MAX_PARALLEL = int(settings.get("dialogue.maxParallel", 4))
+
+
+def turn_params(turn, sample_rate):
+    return {
+        "voice": turn.voice,
+        "language_type": turn.language_type,
+        "sample_rate": sample_rate,
+        "pitch_rate": turn.pitch_rate,
+        "speech_rate": turn.speech_rate,
+        "volume": turn.volume,
+    }
+
+
+def silence(duration_ms, sample_rate=24000, sample_width=2):
+    return bytes(int(sample_rate * duration_ms / 1000) * sample_width)
+
+
+def dialogue_cost(turns):
+    return sum(len(turn.text) for turn in turns)
+
+
+def dialogue_sessions(turns, max_parallel=None):
+    """
+    Number of upstream sessions a dialogue keeps open at once.
+    """
+    return min(max_parallel or MAX_PARALLEL, MAX_PARALLEL, max(len(turns), 1))
+
+
+def synthesize_turn(model, params, text, timeline=None):
+    """
+    Synthesize one dialogue turn and return (pcm_chunks, usage_characters).
+    """
+    if SEGMENT_CACHE_ENABLED:
+        # Segments run in this worker, so a turn holds at most one upstream session
+        plan = SegmentPlan(model, params, text, timeline).run()
+        return list(plan.iter_pcm()), plan.usage_characters
+    return synthesize_pcm(model, params, text, timeline)
+
+
+class DialogueRun:
+    """
+    Synthesizes all turns of a dialogue concurrently with a bounded fan-out
+    and hands them back strictly in script order.
+    """
+    def __init__(self, turns, models, sample_rate, gap_ms, max_parallel=None, timeline=None):
+        self.turns = turns
+        self.models = models
+        self.sample_rate = sample_rate
+        self.gap_ms = gap_ms
+        self.timeline = timeline
+        self._executor = ThreadPoolExecutor(max_workers=dialogue_sessions(turns, max_parallel), thread_name_prefix="dialogue")
+        self._futures = []
+        self.usage_characters = 0
+
+    def start(self):
+        for turn, model in zip(self.turns, self.models):
+            logger.debug(f"Dialogue turn queued: speaker={turn.speaker}, voice={turn.voice}, model={model}")
+            self._futures.append(self._executor.submit(
+                synthesize_turn, model, turn_params(turn, self.sample_rate), turn.text, self.timeline
+            ))
+        return self
+
+    def results(self, timeout=60):
+        """
+        Yield (index, turn, pcm_chunks) in order; the gap before each turn is its first chunk.
+        """
+        try:
+            for index, (turn, future) in enumerate(zip(self.turns, self._futures)):
+                pcm_chunks, usage_characters = future.result(timeout=timeout)
+                self.usage_characters += usage_characters
+                if index > 0:
+                    gap_ms = turn.gap_ms if turn.gap_ms is not None else self.gap_ms
+                    pcm_chunks = [silence(gap_ms, self.sample_rate)] + list(pcm_chunks)
+                yield index, turn, [chunk for chunk in pcm_chunks if len(chunk)]
+        finally:
+            self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
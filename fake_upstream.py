@@ -0,0 +1,120 @@
+"""
+Local fake of the DashScope realtime TTS WebSocket for development and load-balancing tests.
+
+Each upstream is given as port:latency_ms[:error_rate[:speed[:stall_rate]]], e.g.
+
+    python fake_upstream.py 9101:40 9102:250 9103:40:0.5 9104:40:0:5 9105:40:0:0:1
+
+and can then be listed under dashscope.endpoints as ws://127.0.0.1:<port>.
+The audio is a sine tone whose length follows the text length; speed paces it
+at that multiple of real time (0, the default, sends it at once). With stall_rate a
+response never sends any audio, as a hung upstream would. A voice starting with "invalid"
+is rejected with an invalid_request_error, as the real service does for unknown voices.
+"""
+import sys
+import math
+import uuid
+import json
+import base64
+import random
+import asyncio
+from array import array
+from aiohttp import web, WSMsgType
+
+SAMPLE_RATE = 24000
+CHUNK_MS = 100
+MS_PER_CHARACTER = 40
+
+
+def tone(text, frequency=440.0):
+    samples = int(SAMPLE_RATE * len(text) * MS_PER_CHARACTER / 1000)
+    return array('h', (int(8000 * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE)) for i in range(samples))).tobytes()
+
+
+def event(event_type, **fields):
+    return json.dumps({"event_id": f"event_{uuid.uuid4().hex}", "type": event_type, **fields})
+
+
+def make_handler(latency_ms, error_rate, speed, stall_rate=0.0):
+    async def handler(request):
+        # Connect latency: delay the handshake
+        await asyncio.sleep(latency_ms / 1000)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        session_id = f"sess_{uuid.uuid4().hex}"
+        await ws.send_str(event("session.created", session={"id": session_id}))
+        buffer = []
+
+        async def respond(text):
+            response_id = f"resp_{uuid.uuid4().hex}"
+            await ws.send_str(event("response.created", response={"id": response_id}))
+            # First-delta latency
+            await asyncio.sleep(latency_ms / 1000)
+            if random.random() < error_rate:
+                await ws.send_str(event("error", error={"type": "server_error", "message": "injected upstream error"}))
+                return False
+            if random.random() < stall_rate:
+                await asyncio.Event().wait()
+            pcm = tone(text)
+            chunk_bytes = SAMPLE_RATE * CHUNK_MS // 1000 * 2
+            for offset in range(0, len(pcm), chunk_bytes):
+                await ws.send_str(event("response.audio.delta", response_id=response_id,
+                                        delta=base64.b64encode(pcm[offset:offset + chunk_bytes]).decode()))
+                if speed:
+                    await asyncio.sleep(CHUNK_MS / 1000 / speed)
+            await ws.send_str(event("response.done", response={"id": response_id, "usage": {"characters": len(text)}}))
+            return True
+
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            data = json.loads(message.data)
+            if data["type"] == "session.update":
+                if str(data.get("session", {}).get("voice", "")).startswith("invalid"):
+                    await ws.send_str(event("error", error={"type": "invalid_request_error", "code": "InvalidParameter",
+                                                            "message": "voice not found"}))
+                    break
+                await ws.send_str(event("session.updated", session={"id": session_id, **data.get("session", {})}))
+            elif data["type"] == "input_text_buffer.append":
+                buffer.append(data.get("text", ""))
+            elif data["type"] == "input_text_buffer.clear":
+                buffer.clear()
+            elif data["type"] == "input_text_buffer.commit":
+                text, buffer = "".join(buffer), []
+                if text and not await respond(text):
+                    break
+            elif data["type"] == "session.finish":
+                text, buffer = "".join(buffer), []
+                if text and not await respond(text):
+                    break
+                await ws.send_str(event("session.finished"))
+                break
+        await ws.close()
+        return ws
+    return handler
+
+
+async def serve(specs):
+    runners = []
+    for spec in specs:
+        parts = spec.split(":")
+        port, latency_ms = int(parts[0]), float(parts[1]) if len(parts) > 1 else 0.0
+        error_rate = float(parts[2]) if len(parts) > 2 else 0.0
+        speed = float(parts[3]) if len(parts) > 3 else 0.0
+        stall_rate = float(parts[4]) if len(parts) > 4 else 0.0
+        app = web.Application()
+        app.router.add_get("/{tail:.*}", make_handler(latency_ms, error_rate, speed, stall_rate))
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        runners.append(runner)
+        print(f"Fake upstream on ws://127.0.0.1:{port} (latency={latency_ms}ms, error_rate={error_rate}, speed={speed}, stall_rate={stall_rate})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(sys.argv[1:] or ["9101:0"]))
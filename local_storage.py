@@ -0,0 +1,231 @@
+import os
+import re
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+from collections import deque
+from config import settings, logger
+
+# Any number of shard levels, so files written under an earlier shardDepth stay servable
+FILE_PATTERN = re.compile(r'^(?:[0-9a-f]{2}/)*[0-9a-f-]{36}\.wav$')
+EVICTION_BATCH = 500
+
+
+class LocalStore:
+    """
+    Local output store: files are sharded into hashed subdirectories and tracked in a SQLite index,
+    so quota and TTL eviction never have to scan the directory tree.
+    """
+    def __init__(self, root, max_bytes=0, ttl_seconds=0, shard_depth=2):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.shard_depth = shard_depth
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._access_lock = threading.Lock()
+        self._accessed = {}
+        self._evictions = deque()
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        os.makedirs(root, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, ".index.sqlite"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_created ON files (created)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_last_access ON files (last_access)")
+        self._db.commit()
+        if self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 0:
+            self._import_existing()
+        self.total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+
+    def _import_existing(self):
+        """
+        One-time migration of files written before the index existed.
+        """
+        rows = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, "/")
+                if FILE_PATTERN.match(path):
+                    stat = os.stat(os.path.join(dirpath, name))
+                    rows.append((path, stat.st_size, stat.st_mtime, stat.st_mtime))
+        if rows:
+            self._db.executemany("INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?)", rows)
+            self._db.commit()
+            logger.info(f"LocalStore: indexed {len(rows)} existing files in {self.root}")
+
+    def shard_path(self, file_name):
+        digest = hashlib.sha1(file_name.encode()).hexdigest()
+        shards = [digest[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+        return "/".join(shards + [file_name])
+
+    def save(self, data):
+        """
+        Write a WAV file (bytes or WavChunks, written part by part) and return its path relative to the store root.
+        """
+        path = self.shard_path(f"{uuid.uuid4()}.wav")
+        full_path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as f:
+            if isinstance(data, (bytes, bytearray)):
+                f.write(data)
+            else:
+                f.writelines(data)
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (path, len(data), now, now))
+            self._db.commit()
+            self.total_bytes += len(data)
+        logger.debug(f"LocalStore: saved {full_path}")
+        return path
+
+    def resolve(self, path):
+        """
+        Map a request path to a file on disk, or None if it is not a stored file.
+        """
+        if not FILE_PATTERN.match(path):
+            return None
+        full_path = os.path.join(self.root, path)
+        return full_path if os.path.isfile(full_path) else None
+
+    def touch(self, path):
+        # Buffered in memory; the next eviction pass writes it to the index
+        with self._access_lock:
+            self._accessed[path] = time.time()
+
+    def _flush_access(self):
+        with self._access_lock:
+            accessed, self._accessed = self._accessed, {}
+        if accessed:
+            with self._lock:
+                self._db.executemany("UPDATE files SET last_access = ? WHERE path = ?",
+                                     [(last_access, path) for path, last_access in accessed.items()])
+                self._db.commit()
+
+    def evict(self):
+        """
+        Write the buffered access times, then delete expired files and least recently accessed files
+        until the quota is met. Victims are picked in batches under the lock and deleted outside it.
+        """
+        with self._evict_lock:
+            self._flush_access()
+            now = time.time()
+            deleted, freed = 0, 0
+            if self.ttl_seconds:
+                files, size = self._evict_batches(lambda failed: self._db.execute(
+                    "SELECT path, size FROM files WHERE created < ? ORDER BY created LIMIT ? OFFSET ?",
+                    (now - self.ttl_seconds, EVICTION_BATCH, failed)
+                ).fetchall())
+                deleted, freed = deleted + files, freed + size
+            if self.max_bytes:
+                files, size = self._evict_batches(self._quota_victims)
+                deleted, freed = deleted + files, freed + size
+            if not deleted:
+                return 0
+            with self._lock:
+                self._evictions.append((now, deleted))
+        logger.info(f"LocalStore: evicted {deleted} files, freed {freed} bytes")
+        return deleted
+
+    def _quota_victims(self, failed):
+        excess = self.total_bytes - self.max_bytes
+        victims = []
+        if excess <= 0:
+            return victims
+        for path, size in self._db.execute(
+            "SELECT path, size FROM files ORDER BY last_access LIMIT ? OFFSET ?", (EVICTION_BATCH, failed)
+        ):
+            if excess <= 0:
+                break
+            victims.append((path, size))
+            excess -= size
+        return victims
+
+    def _evict_batches(self, select):
+        """
+        Delete the files returned by select(failed) batch by batch until it returns none;
+        files that could not be deleted stay indexed and are skipped through the offset.
+        """
+        deleted_files, freed, failed = 0, 0, 0
+        while True:
+            with self._lock:
+                victims = select(failed)
+            if not victims:
+                return deleted_files, freed
+            deleted = []
+            for path, size in victims:
+                try:
+                    os.remove(os.path.join(self.root, path))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(f"LocalStore: failed to delete {path}: {str(e)}")
+                    failed += 1
+                    continue
+                deleted.append((path, size))
+            batch_bytes = sum(size for _, size in deleted)
+            with self._lock:
+                self._db.executemany("DELETE FROM files WHERE path = ?", [(path,) for path, _ in deleted])
+                self._db.commit()
+                self.total_bytes -= batch_bytes
+                self.evicted_files += len(deleted)
+                self.evicted_bytes += batch_bytes
+            deleted_files += len(deleted)
+            freed += batch_bytes
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            while self._evictions and self._evictions[0][0] < now - 3600:
+                self._evictions.popleft()
+            evicted_last_hour = sum(count for _, count in self._evictions)
+            files = self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            return {
+                "files": files,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "usage_ratio": round(self.total_bytes / self.max_bytes, 4) if self.max_bytes else None,
+                "ttl_seconds": self.ttl_seconds,
+                "evicted_files_total": self.evicted_files,
+                "evicted_bytes_total": self.evicted_bytes,
+                "evicted_files_last_hour": evicted_last_hour,
+                "eviction_rate_per_minute": round(evicted_last_hour / 60, 2),
+            }
+
+
+class LocalBackend:
+    """
+    Storage backend for storageType local; files are served by this app under /output.
+    """
+    def save(self, wav_audio_data, output_dir=None, base_url=None):
+        path = get_local_store(output_dir).save(wav_audio_data)
+        clean_base_url = str(base_url).rstrip('/')
+        return f"{clean_base_url}/output/{path}"
+
+
+EVICTION_INTERVAL = float(settings.get("localStorage.evictionIntervalSeconds", 60))
+CACHE_MAX_AGE = int(settings.get("localStorage.cacheMaxAge", 86400))
+
+_local_stores = {}
+_local_stores_lock = threading.Lock()
+
+
+def get_local_store(root=None):
+    """
+    Return the shared store for an output directory, creating it on first use.
+    """
+    root = root or settings.get("outputDir", "output")
+    with _local_stores_lock:
+        if root not in _local_stores:
+            _local_stores[root] = LocalStore(
+                root,
+                max_bytes=int(float(settings.get("localStorage.maxMegabytes", 0)) * 1024 * 1024),
+                ttl_seconds=int(float(settings.get("localStorage.ttlHours", 0)) * 3600),
+                shard_depth=int(settings.get("localStorage.shardDepth", 2)),
+            )
+        return _local_stores[root]
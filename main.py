@@ -1,22 +1,33 @@
-import io
-import base64
+import asyncio
 import json
 import os
 import queue
-import requests
-from dashscope.audio.qwen_tts_realtime import QwenTtsRealtime, AudioFormat
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import Response, StreamingResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import Response, StreamingResponse, FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
 from typing import Optional
-import uvicorn
 
 from config import settings, logger
-from models import TTSRequest
+from models import TTSRequest, TextStreamRequest, SegmentWarmupRequest, DialogueRequest
 from callbacks import HttpCallback, SSECallback
-from utils import init_dashscope_api_key, pcm_to_wav, save_audio
+from utils import get_dashscope_api_key, validate_dashscope_api_key, save_audio
+from timing import RequestTimeline, RequestProfiler, recorder, profiling_requested
+from synthesis import session_params, start_session, iter_pcm
+from pcm_pipeline import PcmPipeline, AccumulateStage, ResampleStage, SseEncodeStage, PersistStage, WavChunks
+from segment_cache import SEGMENT_CACHE_ENABLED, SegmentPlan, segment_cache, warmup, warmup_from_settings
+from text_stream import TextStreamSession, DuplexStreamingResponse, read_ndjson, feed_text, \
+    TEXT_STREAM_DEFAULT_COST, TEXT_STREAM_IDLE_TIMEOUT
+from dialogue import DialogueRun, dialogue_cost, dialogue_sessions
+from local_storage import get_local_store, EVICTION_INTERVAL, CACHE_MAX_AGE
+from upstream import balancer, CUSTOMIZATION_URL
+from storage import get_backend
+from readiness import readiness
+from admission import admit, admission_stats, usage_scope
+from usage import ledger, FLUSH_INTERVAL
 
 
 # Voice Design Request Models
@@ -42,8 +53,59 @@ class VoiceDesignTTSRequest(BaseModel):
     speech_rate: Optional[float] = 1.0
     volume: Optional[float] = 50
     pitch_rate: Optional[float] = 1.0
+    output_sample_rate: Optional[int] = None  # Resampling der Ausgabe, z.B. 16000 oder 8000
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Heavy imports, API key validation and cache warm-up run in the background so the server
+    # accepts connections immediately; /ready turns green once all checks have passed
+    checks = [
+        ("realtime_sdk", preload_realtime_sdk),
+        ("api_key", validate_dashscope_api_key),
+    ]
+    if ENABLE_SAVE:
+        checks.append(("storage", get_backend))
+    if SEGMENT_CACHE_ENABLED:
+        checks.append(("segment_cache_warmup", warmup_from_settings))
+    readiness.start(checks)
+    eviction_task = None
+    if ENABLE_SAVE and STORAGE_TYPE == "local":
+        eviction_task = asyncio.create_task(evict_periodically(get_local_store(OUTPUT_DIR)))
+    flush_task = asyncio.create_task(flush_usage_periodically()) if ledger else None
+    yield
+    if eviction_task:
+        eviction_task.cancel()
+    if flush_task:
+        flush_task.cancel()
+        ledger.flush()
+
+
+async def flush_usage_periodically():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(ledger.flush)
+        except Exception as e:
+            logger.exception(f"Usage flush failed: {str(e)}")
+
+
+def preload_realtime_sdk():
+    import dashscope.audio.qwen_tts_realtime  # noqa: F401
+
+
+async def evict_periodically(store):
+    """
+    Background retention for the local output store: TTL and quota eviction via the index.
+    """
+    while True:
+        await asyncio.sleep(EVICTION_INTERVAL)
+        try:
+            await asyncio.to_thread(store.evict)
+        except Exception as e:
+            logger.exception(f"Local storage eviction failed: {str(e)}")
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS für Browser-Zugriff aktivieren
 app.add_middleware(
@@ -52,6 +114,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-Id", "X-Sample-Rate", "Server-Timing"],
 )
 
 # Configure storage
@@ -61,90 +124,139 @@ if isinstance(ENABLE_SAVE, str):
 
 STORAGE_TYPE = settings.get("storageType", "local").lower()
 OUTPUT_DIR = settings.get("outputDir", "output")
+
+
+def serve_output(file_path: str, http_request: Request):
+    """
+    Serve saved audio with ETag, Cache-Control and byte-range support.
+    """
+    store = get_local_store(OUTPUT_DIR)
+    full_path = store.resolve(file_path)
+    if full_path is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    # File names are unique and files are never rewritten, so the name is a stable ETag
+    etag = f'"{os.path.basename(file_path)[:-len(".wav")]}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={CACHE_MAX_AGE}, immutable",
+        "Accept-Ranges": "bytes",
+    }
+    if etag in http_request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    store.touch(file_path)
+    return FileResponse(full_path, media_type="audio/wav", headers=headers)
+
+
 if ENABLE_SAVE and STORAGE_TYPE == "local":
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
-    # Mount static files to serve saved audio
-    app.mount("/output", StaticFiles(directory=OUTPUT_DIR), name="output")
+    get_local_store(OUTPUT_DIR)
+    # Serve saved audio from the sharded local store
+    app.add_api_route("/output/{file_path:path}", serve_output, methods=["GET", "HEAD"], include_in_schema=False)
 
-# Initialize API key on startup
-init_dashscope_api_key()
+# Fail fast on a missing API key; the SDK itself is loaded and the key validated in the background
+get_dashscope_api_key()
 
 
 @app.post("/tts")
 async def text_to_speech(request: TTSRequest, http_request: Request):
     logger.info(f"Received TTS request: voice={request.voice}, model={request.model}")
-    callback = HttpCallback()
+    timeline = RequestTimeline("/tts")
+    # Wait for admission on the event loop; only admitted requests occupy a threadpool worker
+    ticket = await admit(http_request, timeline, request.model, len(request.text))
+    return await run_in_threadpool(synthesize_wav, request, http_request, timeline, ticket)
 
-    # Initialize QwenTtsRealtime for each request to ensure isolation
-    qwen_tts_realtime = QwenTtsRealtime(
-        model=request.model,
-        callback=callback,
-        url=settings.get('dashscope.url', 'wss://dashscope.aliyuncs.com/api-ws/v1/realtime')
-    )
 
+def synthesize_wav(request, http_request, timeline, ticket):
+    """
+    Blocking part of /tts: synthesis until the audio is complete, saving and the response.
+    """
+    profiler = RequestProfiler(timeline, profiling_requested(http_request))
+    if profiler.start():
+        profiler.resume()
+
+    status = "error"
     try:
-        logger.debug("Connecting to DashScope...")
-        qwen_tts_realtime.connect()
-        logger.debug(f"Updating session: voice={request.voice}")
-        qwen_tts_realtime.update_session(
-            voice=request.voice,
-            response_format=AudioFormat.PCM_24000HZ_MONO_16BIT,
-            mode='server_commit',
-            format='pcm',
-            language_type=request.language_type,
-            sample_rate=request.sample_rate,
-            pitch_rate=request.pitch_rate,
-            speech_rate=request.speech_rate,
-            volume=request.volume,
-        )
-
-        logger.debug(f"Appending text: {request.text[:50]}...")
-        qwen_tts_realtime.append_text(request.text)
-        qwen_tts_realtime.finish()
-
-        # Wait for the generation to complete
-        logger.debug("Waiting for TTS synthesis to finish...")
-        if not callback.wait_for_finished(timeout=60):
-            logger.error("TTS synthesis timed out")
-            raise HTTPException(status_code=504, detail="TTS synthesis timed out")
-
-        if callback.error_msg:
-            logger.error(f"TTS synthesis error: {callback.error_msg}")
-            raise HTTPException(status_code=500, detail=f"TTS synthesis error: {callback.error_msg}")
-
-        audio_data = callback.get_audio_data()
-
-        if not audio_data:
-            logger.error("No audio data generated")
-            raise HTTPException(status_code=500, detail="No audio data generated")
+        saved_characters = 0
+        sample_rate = output_sample_rate(request)
+        if SEGMENT_CACHE_ENABLED:
+            plan = SegmentPlan(request.model, session_params(request), request.text, timeline).start()
+            accumulator = AccumulateStage()
+            pipeline = PcmPipeline(resample_stages(request) + [accumulator], timeline)
+            try:
+                with timeline.span("synthesis"):
+                    for pcm in plan.iter_pcm():
+                        pipeline.push(pcm)
+                    pipeline.close()
+            except queue.Empty:
+                logger.error("TTS synthesis timed out")
+                raise HTTPException(status_code=504, detail="TTS synthesis timed out")
+            wav_audio_data = accumulator.wav(sample_rate)
+            if not accumulator.size:
+                logger.error("No audio data generated")
+                raise HTTPException(status_code=500, detail="No audio data generated")
+            session_id = None
+            first_audio_delay = None
+            usage_characters = str(plan.usage_characters)
+            saved_characters = plan.saved_characters
+            logger.info(f"Segment cache: segments={len(plan.segments)}, synthesized={len(plan.jobs)}, saved_characters={saved_characters}")
+        else:
+            callback = HttpCallback(timeline, resample_stages(request))
 
-        session_id = qwen_tts_realtime.get_session_id()
-        first_audio_delay = qwen_tts_realtime.get_first_audio_delay()
-        logger.info(f"TTS synthesis completed: session_id={session_id}, first_audio_delay={first_audio_delay}ms, audio_size={len(audio_data)} bytes")
+            logger.debug(f"Starting DashScope session: voice={request.voice}")
+            qwen_tts_realtime = start_session(request.model, callback, dict(session_params(request), format='pcm'),
+                                              request.text, timeline)
 
-        headers = {
-            "X-Session-Id": session_id or "",
-            "X-First-Audio-Delay": str(first_audio_delay or 0),
-            "X-Usage-Characters":callback.get_usage_characters()
-        }
+            # Wait for the generation to complete
+            logger.debug("Waiting for TTS synthesis to finish...")
+            with timeline.span("synthesis"):
+                finished = callback.wait_for_finished(timeout=60)
+            if not finished:
+                logger.error("TTS synthesis timed out")
+                callback.abort("timeout")
+                raise HTTPException(status_code=504, detail="TTS synthesis timed out")
+
+            if callback.error_msg:
+                logger.error(f"TTS synthesis error: {callback.error_msg}")
+                raise HTTPException(status_code=500, detail=f"TTS synthesis error: {callback.error_msg}")
 
-        # Encapsulate PCM data into WAV format
-        wav_audio_data = pcm_to_wav(audio_data)
+            wav_audio_data = callback.get_audio_wav(sample_rate)
+
+            if not callback.accumulator.size:
+                logger.error("No audio data generated")
+                raise HTTPException(status_code=500, detail="No audio data generated")
+
+            session_id = qwen_tts_realtime.get_session_id()
+            first_audio_delay = qwen_tts_realtime.get_first_audio_delay()
+            usage_characters = callback.get_usage_characters()
+        logger.info(f"TTS synthesis completed: session_id={session_id}, first_audio_delay={first_audio_delay}ms, audio_size={len(wav_audio_data)} bytes")
 
         file_url = None
         if ENABLE_SAVE:
             logger.debug("Saving audio file...")
-            file_url = save_audio(wav_audio_data, OUTPUT_DIR, http_request.base_url)
+            with timeline.span("save_audio"):
+                file_url = save_audio(wav_audio_data, OUTPUT_DIR, http_request.base_url)
             logger.info(f"Audio saved: {file_url}")
 
+        if request.return_url and not ENABLE_SAVE:
+            logger.warning("Saving is disabled, but return_url requested")
+            raise HTTPException(status_code=400, detail="Saving is disabled, cannot return URL")
+
+        status = "ok"
+        timeline.finish(status)
+        headers = {
+            "X-Session-Id": session_id or "",
+            "X-First-Audio-Delay": str(first_audio_delay or 0),
+            "X-Usage-Characters":usage_characters,
+            "X-Saved-Characters": str(saved_characters),
+            "X-Request-Id": timeline.request_id,
+            "Server-Timing": timeline.server_timing()
+        }
+
         if request.return_url:
-            if not ENABLE_SAVE:
-                logger.warning("Saving is disabled, but return_url requested")
-                raise HTTPException(status_code=400, detail="Saving is disabled, cannot return URL")
             return Response(content=json.dumps({"url": file_url}), media_type="application/json", headers=headers)
 
-        return Response(content=wav_audio_data, media_type="audio/wav", headers=headers)
+        # The WAV header and the PCM chunks are sent one after another, never joined
+        headers["Content-Length"] = str(len(wav_audio_data))
+        return StreamingResponse(wav_audio_data.stream(), media_type="audio/wav", headers=headers)
 
     except Exception as e:
         logger.exception(f"Unexpected error in /tts: {str(e)}")
@@ -152,79 +264,194 @@ async def text_to_speech(request: TTSRequest, http_request: Request):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        # Ensure resources are cleaned up if necessary
-        # QwenTtsRealtime might need explicit closing if not handled by callback
-        pass
+        profiler.stop()
+        recorder.record(timeline.finish(status))
+        ticket.release()
 
 
 @app.post("/tts_stream")
 async def text_to_speech_stream(request: TTSRequest, http_request: Request):
     logger.info(f"Received TTS stream request: voice={request.voice}, model={request.model}")
-    callback = SSECallback()
+    timeline = RequestTimeline("/tts_stream")
+    profiler = RequestProfiler(timeline, profiling_requested(http_request))
+    ticket = await admit(http_request, timeline, request.model, len(request.text))
+    if SEGMENT_CACHE_ENABLED:
+        return StreamingResponse(ticket.wrap(profiler.wrap(generate_from_segments(request.model, request, http_request, timeline))),
+                                 media_type="text/event-stream", headers={"X-Request-Id": timeline.request_id},
+                                 background=BackgroundTask(ticket.release))
+    logger.debug(f"Starting DashScope session (stream): voice={request.voice}")
+    events = stream_session(request.model, dict(session_params(request), format='pcm'), request, http_request, timeline)
+    return StreamingResponse(ticket.wrap(profiler.wrap(events)), media_type="text/event-stream",
+                             headers={"X-Request-Id": timeline.request_id}, background=BackgroundTask(ticket.release))
 
-    # Initialize QwenTtsRealtime for each request to ensure isolation
-    qwen_tts_realtime = QwenTtsRealtime(
-        model=request.model,
-        callback=callback,
-        url=settings.get('dashscope.url', 'wss://dashscope.aliyuncs.com/api-ws/v1/realtime')
-    )
+
+@app.post("/tts_pcm_stream")
+async def text_to_speech_pcm_stream(request: TTSRequest, http_request: Request):
+    """
+    Streams raw 16-bit mono PCM without base64/JSON framing, for low-latency clients.
+    Audio is not saved on this route.
+    """
+    logger.info(f"Received TTS PCM stream request: voice={request.voice}, model={request.model}")
+    timeline = RequestTimeline("/tts_pcm_stream")
+    profiler = RequestProfiler(timeline, profiling_requested(http_request))
+    ticket = await admit(http_request, timeline, request.model, len(request.text))
 
     def generate():
-        audio_accumulator = io.BytesIO()
+        status = "error"
         try:
-            logger.debug("Connecting to DashScope (stream)...")
-            qwen_tts_realtime.connect()
-            logger.debug(f"Updating session (stream): voice={request.voice}")
-            qwen_tts_realtime.update_session(
-                voice=request.voice,
-                response_format=AudioFormat.PCM_24000HZ_MONO_16BIT,
-                mode='server_commit',
-                format='pcm',
-                language_type=request.language_type,
-                sample_rate=request.sample_rate,
-                pitch_rate=request.pitch_rate,
-                speech_rate=request.speech_rate,
-                volume=request.volume,
-            )
-
-            logger.debug(f"Appending text (stream): {request.text[:50]}...")
-            qwen_tts_realtime.append_text(request.text)
-            qwen_tts_realtime.finish()
-
-            while True:
-                try:
-                    item = callback.queue.get(timeout=30)
-                    if item is None:
-                        logger.debug("Stream finished (received None)")
-                        # Handle accumulated audio
-                        pcm_data = audio_accumulator.getvalue()
-                        usage_characters = callback.get_usage_characters()
-                        if pcm_data and ENABLE_SAVE:
-                            logger.debug("Saving accumulated audio from stream...")
-                            wav_data = pcm_to_wav(pcm_data)
-                            file_url = save_audio(wav_data, OUTPUT_DIR, http_request.base_url)
-                            logger.info(f"Stream audio saved: {file_url}")
-                            yield f"data: {json.dumps({'is_end': True, 'url': file_url, 'usage_characters': usage_characters})}\n\n"
-                        else:
-                            yield f"data: {json.dumps({'is_end': True, 'usage_characters': usage_characters})}\n\n"
-                        break
-                    
-                    if isinstance(item, dict) and "audio" in item:
-                        audio_accumulator.write(base64.b64decode(item["audio"]))
-
-                    yield f"data: {json.dumps(item)}\n\n"
-                except queue.Empty:
-                    logger.error("Stream synthesis timed out waiting for audio")
-                    yield f"data: {json.dumps({'error': 'Timeout waiting for audio'})}\n\n"
-                    break
+            if SEGMENT_CACHE_ENABLED:
+                chunks = SegmentPlan(request.model, session_params(request), request.text, timeline).start().iter_pcm()
+            else:
+                callback = SSECallback(timeline)
+                start_session(request.model, callback, session_params(request), request.text, timeline)
+                chunks = iter_pcm(callback, timeline)
+            pipeline = PcmPipeline(resample_stages(request), timeline)
+            for pcm in chunks:
+                timeline.mark("first_delta")
+                chunk = pipeline.push(pcm)
+                if chunk is not None:
+                    yield chunk.pcm
+            for chunk in pipeline.close():
+                yield chunk.pcm
+            timeline.mark("upstream_done")
+            status = "ok"
+        except queue.Empty:
+            logger.error("PCM stream timed out waiting for audio")
         except Exception as e:
-            logger.exception(f"Error in stream generation: {str(e)}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            logger.exception(f"Error in PCM stream: {str(e)}")
         finally:
-            # Clean up if needed
-            pass
+            recorder.record(timeline.finish(status))
+
+    headers = {"X-Request-Id": timeline.request_id, "X-Sample-Rate": str(output_sample_rate(request))}
+    return StreamingResponse(ticket.wrap(profiler.wrap(generate())), media_type="application/octet-stream", headers=headers,
+                             background=BackgroundTask(ticket.release))
+
+
+def output_sample_rate(request):
+    return getattr(request, "output_sample_rate", None) or request.sample_rate or 24000
+
+
+def resample_stages(request):
+    source_rate = request.sample_rate or 24000
+    target_rate = output_sample_rate(request)
+    return [ResampleStage(source_rate, target_rate)] if target_rate != source_rate else []
+
+
+def sse_pipeline(request, http_request, timeline):
+    """
+    PCM pipeline of the SSE routes: optional resampling, SSE encoding and, if saving is enabled,
+    accumulation of the chunks that are persisted as WAV when the pipeline is closed.
+    """
+    stages = resample_stages(request) + [SseEncodeStage()]
+    persist = None
+    if ENABLE_SAVE:
+        accumulator = AccumulateStage()
+        persist = PersistStage(accumulator, lambda wav: save_audio(wav, OUTPUT_DIR, http_request.base_url),
+                               output_sample_rate(request))
+        stages += [accumulator, persist]
+    return PcmPipeline(stages, timeline), persist
+
+
+def end_event(pipeline, persist, **fields):
+    """
+    Close the pipeline and render the final is_end event, preceded by any audio still buffered in a stage.
+    """
+    events = [chunk.event for chunk in pipeline.close()]
+    event = {'is_end': True, **fields}
+    if persist and persist.url:
+        event['url'] = persist.url
+    events.append(f"data: {json.dumps(event)}\n\n")
+    return events
+
+
+def stream_session(model, params, request, http_request, timeline):
+    """
+    SSE generator for one upstream session started with the full request text.
+    """
+    callback = SSECallback(timeline)
+    return stream_events(callback, request, http_request, timeline,
+                         start=lambda: start_session(model, callback, params, request.text, timeline))
+
+
+def stream_events(callback, request, http_request, timeline, start=None, timeout=30):
+    """
+    SSE generator over the queue of an SSECallback. Each delta is decoded once; the upstream base64 is re-sent
+    as is and the decoded chunk is kept for the saved WAV.
+    """
+    pipeline, persist = sse_pipeline(request, http_request, timeline)
+    status = "error"
+    try:
+        if start:
+            start()
+        while True:
+            try:
+                item = callback.queue.get(timeout=timeout)
+            except queue.Empty:
+                logger.error("Stream synthesis timed out waiting for audio")
+                callback.abort("timeout")
+                yield f"data: {json.dumps({'error': 'Timeout waiting for audio'})}\n\n"
+                break
+            if item is None:
+                logger.debug("Stream finished (received None)")
+                timeline.mark("upstream_done")
+                if not callback.error_msg:
+                    status = "ok"
+                yield from end_event(pipeline, persist, usage_characters=callback.get_usage_characters())
+                if persist and persist.url:
+                    logger.info(f"Stream audio saved: {persist.url}")
+                break
+            if "audio" in item:
+                chunk = pipeline.push_b64(item["audio"])
+                if chunk is not None:
+                    yield chunk.event
+            else:
+                yield f"data: {json.dumps(item)}\n\n"
+    except Exception as e:
+        logger.exception(f"Error in stream generation: {str(e)}")
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    finally:
+        recorder.record(timeline.finish(status))
+    yield f"data: {json.dumps({'timing': timeline.to_dict()})}\n\n"
+
+
+def generate_from_segments(model, request, http_request, timeline):
+    """
+    SSE generator for the segment cache: cached segments are emitted immediately,
+    missing ones are streamed from their upstream sessions in order.
+    """
+    status = "error"
+    pipeline, persist = sse_pipeline(request, http_request, timeline)
+    try:
+        plan = SegmentPlan(model, session_params(request), request.text, timeline).start()
+        for pcm in plan.iter_pcm():
+            timeline.mark("first_delta")
+            chunk = pipeline.push(pcm)
+            if chunk is not None:
+                yield chunk.event
+        timeline.mark("upstream_done")
+        status = "ok"
+        yield from end_event(pipeline, persist, usage_characters=str(plan.usage_characters),
+                             saved_characters=plan.saved_characters)
+    except queue.Empty:
+        logger.error("Stream synthesis timed out waiting for audio")
+        yield f"data: {json.dumps({'error': 'Timeout waiting for audio'})}\n\n"
+    except Exception as e:
+        logger.exception(f"Error in segment stream: {str(e)}")
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    finally:
+        recorder.record(timeline.finish(status))
+    yield f"data: {json.dumps({'timing': timeline.to_dict()})}\n\n"
 
-    return StreamingResponse(generate(), media_type="text/event-stream")
+
+@app.get("/ready")
+def readiness_check():
+    """
+    Readiness probe: 503 until the SDK is loaded, the API key is validated and warm-up has finished.
+    """
+    status = readiness.status()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
 
 
 @app.get("/health")
@@ -232,9 +459,83 @@ def health_check():
     return {"status": "ok"}
 
 
+@app.get("/storage/stats")
+def storage_stats():
+    """
+    Disk usage and eviction rate of the local output store.
+    """
+    if not (ENABLE_SAVE and STORAGE_TYPE == "local"):
+        return {"storage_type": STORAGE_TYPE, "enabled": ENABLE_SAVE}
+    return {"storage_type": STORAGE_TYPE, "enabled": ENABLE_SAVE, **get_local_store(OUTPUT_DIR).stats()}
+
+
+@app.get("/usage")
+def usage_report(http_request: Request, client: Optional[str] = None, hours: int = 24):
+    """
+    Usage per client and model over the last hours, plus the live admission state.
+    """
+    client, admin = usage_scope(http_request, client)
+    admission = admission_stats()
+    if not admin:
+        admission["clients"] = {name: state for name, state in admission["clients"].items() if name == client}
+    return {
+        "hours": hours,
+        "clients": ledger.report(client, hours) if ledger else [],
+        "admission": admission,
+    }
+
+
+@app.get("/upstream/stats")
+def upstream_stats():
+    """
+    Per-endpoint latency, error rate, traffic share and ejection state of the upstream balancer.
+    """
+    return balancer.stats()
+
+
+@app.get("/segment_cache/stats")
+def segment_cache_stats():
+    return segment_cache.stats()
+
+
+@app.post("/segment_cache/warmup")
+def segment_cache_warmup(request: SegmentWarmupRequest):
+    """
+    Pre-populate the segment cache with known phrases for one voice and parameter set.
+    """
+    logger.info(f"Segment cache warm-up request: voice={request.voice}, phrases={len(request.phrases)}")
+    try:
+        synthesized = warmup(request.model, session_params(request), request.phrases)
+    except queue.Empty:
+        raise HTTPException(status_code=504, detail="Warm-up timed out waiting for audio")
+    except Exception as e:
+        logger.exception(f"Segment cache warm-up failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"success": True, "synthesized": synthesized, "cache": segment_cache.stats()}
+
+
+@app.get("/debug/requests")
+def debug_requests(limit: int = 50, slowest: int = 10):
+    """
+    Recent request timelines with the slowest requests and per-stage percentiles.
+    """
+    return recorder.snapshot(limit=limit, slowest=slowest)
+
+
+@app.get("/debug/requests/{request_id}")
+def debug_request(request_id: str):
+    """
+    Timeline of a single request, including the profiler output if it was profiled.
+    """
+    timeline = recorder.get(request_id)
+    if timeline is None:
+        raise HTTPException(status_code=404, detail="Request not found")
+    return timeline.to_dict(include_profile=True)
+
+
 # ============ Voice Design Endpoints ============
 
-VOICE_DESIGN_URL = "https://dashscope-intl.aliyuncs.com/api/v1/services/audio/tts/customization"
+VOICE_DESIGN_URL = CUSTOMIZATION_URL
 VOICE_DESIGN_MODEL = "qwen-voice-design"
 VOICE_DESIGN_TARGET_MODEL = "qwen3-tts-vd-realtime-2025-12-16"
 
@@ -247,9 +548,9 @@ async def create_voice(request: VoiceDesignRequest):
     """
     logger.info(f"Voice Design request: prompt={request.voice_prompt[:50]}...")
     
-    import dashscope
     import re
-    api_key = dashscope.api_key
+    import requests
+    api_key = get_dashscope_api_key()
     
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -314,8 +615,8 @@ async def list_voices(page_index: int = 0, page_size: int = 20):
     """
     Listet alle erstellten Stimmen auf.
     """
-    import dashscope
-    api_key = dashscope.api_key
+    import requests
+    api_key = get_dashscope_api_key()
     
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -355,8 +656,8 @@ async def delete_voice(voice_name: str):
     """
     Löscht eine erstellte Stimme.
     """
-    import dashscope
-    api_key = dashscope.api_key
+    import requests
+    api_key = get_dashscope_api_key()
     
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -385,7 +686,7 @@ async def delete_voice(voice_name: str):
 
 # ============ Voice Cloning Endpoints ============
 
-VOICE_CLONING_URL = "https://dashscope-intl.aliyuncs.com/api/v1/services/audio/tts/customization"
+VOICE_CLONING_URL = CUSTOMIZATION_URL
 VOICE_CLONING_MODEL = "qwen-voice-enrollment"
 VOICE_CLONING_TARGET_MODEL = "qwen3-tts-vc-realtime-2026-01-15"
 
@@ -398,9 +699,9 @@ async def create_cloned_voice(request: VoiceCloningRequest):
     """
     logger.info(f"Voice Cloning request: mime_type={request.audio_mime_type}")
     
-    import dashscope
     import re
-    api_key = dashscope.api_key
+    import requests
+    api_key = get_dashscope_api_key()
     
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -460,8 +761,8 @@ async def list_cloned_voices(page_index: int = 0, page_size: int = 20):
     """
     Listet alle geklonten Stimmen auf.
     """
-    import dashscope
-    api_key = dashscope.api_key
+    import requests
+    api_key = get_dashscope_api_key()
     
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -499,8 +800,8 @@ async def delete_cloned_voice(voice_name: str):
     """
     Löscht eine geklonte Stimme.
     """
-    import dashscope
-    api_key = dashscope.api_key
+    import requests
+    api_key = get_dashscope_api_key()
     
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -533,58 +834,16 @@ async def tts_voice_cloning_stream(request: VoiceDesignTTSRequest, http_request:
     TTS Streaming mit einer geklonten Stimme.
     """
     logger.info(f"Voice Cloning TTS stream request: voice={request.voice}")
-    callback = SSECallback()
-    
-    qwen_tts_realtime = QwenTtsRealtime(
-        model=VOICE_CLONING_TARGET_MODEL,
-        callback=callback,
-        url=settings.get('dashscope.url', 'wss://dashscope-intl.aliyuncs.com/api-ws/v1/realtime')
-    )
-    
-    def generate():
-        audio_accumulator = io.BytesIO()
-        try:
-            qwen_tts_realtime.connect()
-            qwen_tts_realtime.update_session(
-                voice=request.voice,
-                response_format=AudioFormat.PCM_24000HZ_MONO_16BIT,
-                mode='server_commit',
-                language_type=request.language_type,
-                sample_rate=request.sample_rate,
-                pitch_rate=request.pitch_rate,
-                speech_rate=request.speech_rate,
-                volume=request.volume,
-            )
-            
-            qwen_tts_realtime.append_text(request.text)
-            qwen_tts_realtime.finish()
-            
-            while True:
-                try:
-                    item = callback.queue.get(timeout=30)
-                    if item is None:
-                        pcm_data = audio_accumulator.getvalue()
-                        usage_characters = callback.get_usage_characters()
-                        if pcm_data and ENABLE_SAVE:
-                            wav_data = pcm_to_wav(pcm_data)
-                            file_url = save_audio(wav_data, OUTPUT_DIR, http_request.base_url)
-                            yield f"data: {json.dumps({'is_end': True, 'url': file_url, 'usage_characters': usage_characters})}\n\n"
-                        else:
-                            yield f"data: {json.dumps({'is_end': True, 'usage_characters': usage_characters})}\n\n"
-                        break
-                    
-                    if isinstance(item, dict) and "audio" in item:
-                        audio_accumulator.write(base64.b64decode(item["audio"]))
-                    
-                    yield f"data: {json.dumps(item)}\n\n"
-                except queue.Empty:
-                    yield f"data: {json.dumps({'error': 'Timeout waiting for audio'})}\n\n"
-                    break
-        except Exception as e:
-            logger.exception(f"Error in VC stream: {str(e)}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
-    
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    timeline = RequestTimeline("/tts_vc_stream")
+    profiler = RequestProfiler(timeline, profiling_requested(http_request))
+    ticket = await admit(http_request, timeline, VOICE_CLONING_TARGET_MODEL, len(request.text))
+    if SEGMENT_CACHE_ENABLED:
+        return StreamingResponse(ticket.wrap(profiler.wrap(generate_from_segments(VOICE_CLONING_TARGET_MODEL, request, http_request, timeline))),
+                                 media_type="text/event-stream", headers={"X-Request-Id": timeline.request_id},
+                                 background=BackgroundTask(ticket.release))
+    events = stream_session(VOICE_CLONING_TARGET_MODEL, session_params(request), request, http_request, timeline)
+    return StreamingResponse(ticket.wrap(profiler.wrap(events)), media_type="text/event-stream",
+                             headers={"X-Request-Id": timeline.request_id}, background=BackgroundTask(ticket.release))
 
 
 @app.post("/tts_vd_stream")
@@ -594,65 +853,190 @@ async def tts_voice_design_stream(request: VoiceDesignTTSRequest, http_request:
     Verwendet das spezielle Voice Design TTS Modell.
     """
     logger.info(f"Voice Design TTS stream request: voice={request.voice}")
-    callback = SSECallback()
-    
+    timeline = RequestTimeline("/tts_vd_stream")
+    profiler = RequestProfiler(timeline, profiling_requested(http_request))
+    ticket = await admit(http_request, timeline, VOICE_DESIGN_TARGET_MODEL, len(request.text))
+    if SEGMENT_CACHE_ENABLED:
+        return StreamingResponse(ticket.wrap(profiler.wrap(generate_from_segments(VOICE_DESIGN_TARGET_MODEL, request, http_request, timeline))),
+                                 media_type="text/event-stream", headers={"X-Request-Id": timeline.request_id},
+                                 background=BackgroundTask(ticket.release))
     # Voice Design verwendet ein spezielles Modell
-    qwen_tts_realtime = QwenTtsRealtime(
-        model=VOICE_DESIGN_TARGET_MODEL,
-        callback=callback,
-        url=settings.get('dashscope.url', 'wss://dashscope-intl.aliyuncs.com/api-ws/v1/realtime')
-    )
-    
+    logger.debug(f"Starting DashScope session (VD): voice={request.voice}")
+    events = stream_session(VOICE_DESIGN_TARGET_MODEL, session_params(request), request, http_request, timeline)
+    return StreamingResponse(ticket.wrap(profiler.wrap(events)), media_type="text/event-stream",
+                             headers={"X-Request-Id": timeline.request_id}, background=BackgroundTask(ticket.release))
+
+
+# ============ Text Stream Endpoint ============
+
+@app.post("/tts_text_stream")
+async def tts_text_stream(http_request: Request):
+    """
+    Liest Text als NDJSON-Stream (z.B. LLM-Ausgabe) und streamt das Audio per SSE zurück, sobald der erste Satz vollständig ist.
+    """
+    messages = read_ndjson(http_request)
+    try:
+        request = TextStreamRequest(**await messages.__anext__())
+    except StopAsyncIteration:
+        raise HTTPException(status_code=400, detail="Empty request body")
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    logger.info(f"Received TTS text stream request: voice={request.voice}, model={request.model}")
+    timeline = RequestTimeline("/tts_text_stream")
+    profiler = RequestProfiler(timeline, profiling_requested(http_request))
+    ticket = await admit(http_request, timeline, request.model, request.expected_characters or TEXT_STREAM_DEFAULT_COST)
+
+    callback = SSECallback(timeline)
+    session = TextStreamSession(request.model, callback, session_params(request), timeline)
+    feeder = asyncio.create_task(feed_text(session, request.text, messages))
+
+    async def finish():
+        feeder.cancel()
+        ticket.release()
+
+    events = stream_events(callback, request, http_request, timeline, timeout=TEXT_STREAM_IDLE_TIMEOUT)
+    return DuplexStreamingResponse(ticket.wrap(profiler.wrap(events)), media_type="text/event-stream",
+                                   headers={"X-Request-Id": timeline.request_id}, background=BackgroundTask(finish))
+
+
+# ============ Dialogue Endpoints ============
+
+def resolve_turn_model(turn, default_model):
+    """
+    Route a dialogue turn to the model its voice requires.
+    """
+    if turn.model:
+        return turn.model
+    if turn.voice.startswith("qwen-tts-vd-"):
+        return VOICE_DESIGN_TARGET_MODEL
+    if turn.voice.startswith("qwen-tts-vc-"):
+        return VOICE_CLONING_TARGET_MODEL
+    return default_model
+
+
+def start_dialogue(request, timeline):
+    if not request.turns:
+        raise HTTPException(status_code=400, detail="Dialogue has no turns")
+    models = [resolve_turn_model(turn, request.model) for turn in request.turns]
+    return DialogueRun(request.turns, models, request.sample_rate, request.gap_ms,
+                       request.max_parallel, timeline).start()
+
+
+@app.post("/tts_dialogue")
+async def tts_dialogue(request: DialogueRequest, http_request: Request):
+    """
+    Synthetisiert einen Dialog mit mehreren Stimmen parallel und liefert eine einzige WAV-Datei.
+    """
+    logger.info(f"Dialogue request: turns={len(request.turns)}")
+    timeline = RequestTimeline("/tts_dialogue")
+    ticket = await admit(http_request, timeline, request.model, dialogue_cost(request.turns),
+                         dialogue_sessions(request.turns, request.max_parallel))
+    return await run_in_threadpool(synthesize_dialogue, request, http_request, timeline, ticket)
+
+
+def synthesize_dialogue(request, http_request, timeline, ticket):
+    """
+    Blocking part of /tts_dialogue: waits for all turns and builds the WAV response.
+    """
+    status = "error"
+    try:
+        run = start_dialogue(request, timeline)
+        with timeline.span("synthesis"):
+            chunks = [chunk for _, _, pcm_chunks in run.results() for chunk in pcm_chunks]
+        if not chunks:
+            raise HTTPException(status_code=500, detail="No audio data generated")
+
+        wav_audio_data = WavChunks(chunks, request.sample_rate)
+
+        file_url = None
+        if ENABLE_SAVE:
+            with timeline.span("save_audio"):
+                file_url = save_audio(wav_audio_data, OUTPUT_DIR, http_request.base_url)
+            logger.info(f"Dialogue audio saved: {file_url}")
+
+        if request.return_url and not ENABLE_SAVE:
+            raise HTTPException(status_code=400, detail="Saving is disabled, cannot return URL")
+
+        status = "ok"
+        timeline.finish(status)
+        headers = {
+            "X-Usage-Characters": str(run.usage_characters),
+            "X-Request-Id": timeline.request_id,
+            "Server-Timing": timeline.server_timing()
+        }
+        if request.return_url:
+            return Response(content=json.dumps({"url": file_url}), media_type="application/json", headers=headers)
+        headers["Content-Length"] = str(len(wav_audio_data))
+        return StreamingResponse(wav_audio_data.stream(), media_type="audio/wav", headers=headers)
+
+    except HTTPException:
+        raise
+    except (TimeoutError, queue.Empty):
+        logger.error("Dialogue synthesis timed out")
+        raise HTTPException(status_code=504, detail="TTS synthesis timed out")
+    except Exception as e:
+        logger.exception(f"Unexpected error in /tts_dialogue: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        recorder.record(timeline.finish(status))
+        ticket.release()
+
+
+@app.post("/tts_dialogue_stream")
+async def tts_dialogue_stream(request: DialogueRequest, http_request: Request):
+    """
+    Dialog als SSE-Stream: jeder Turn wird gesendet, sobald er und alle vorherigen Turns fertig sind.
+    """
+    logger.info(f"Dialogue stream request: turns={len(request.turns)}")
+    timeline = RequestTimeline("/tts_dialogue_stream")
+    ticket = await admit(http_request, timeline, request.model, dialogue_cost(request.turns),
+                         dialogue_sessions(request.turns, request.max_parallel))
+    try:
+        run = start_dialogue(request, timeline)
+    except Exception:
+        ticket.release()
+        raise
+    chunk_size = request.sample_rate * 2  # at most one second of 16-bit mono PCM per event
+
     def generate():
-        audio_accumulator = io.BytesIO()
+        # One accumulator across all turns; each turn gets its own encoder carrying turn and speaker
+        accumulator = AccumulateStage()
+        status = "error"
         try:
-            logger.debug("Connecting to DashScope (VD stream)...")
-            qwen_tts_realtime.connect()
-            logger.debug(f"Updating session (VD): voice={request.voice}")
-            qwen_tts_realtime.update_session(
-                voice=request.voice,
-                response_format=AudioFormat.PCM_24000HZ_MONO_16BIT,
-                mode='server_commit',
-                language_type=request.language_type,
-                sample_rate=request.sample_rate,
-                pitch_rate=request.pitch_rate,
-                speech_rate=request.speech_rate,
-                volume=request.volume,
-            )
-            
-            logger.debug(f"Appending text (VD): {request.text[:50]}...")
-            qwen_tts_realtime.append_text(request.text)
-            qwen_tts_realtime.finish()
-            
-            while True:
-                try:
-                    item = callback.queue.get(timeout=30)
-                    if item is None:
-                        pcm_data = audio_accumulator.getvalue()
-                        usage_characters = callback.get_usage_characters()
-                        if pcm_data and ENABLE_SAVE:
-                            wav_data = pcm_to_wav(pcm_data)
-                            file_url = save_audio(wav_data, OUTPUT_DIR, http_request.base_url)
-                            yield f"data: {json.dumps({'is_end': True, 'url': file_url, 'usage_characters': usage_characters})}\n\n"
-                        else:
-                            yield f"data: {json.dumps({'is_end': True, 'usage_characters': usage_characters})}\n\n"
-                        break
-                    
-                    if isinstance(item, dict) and "audio" in item:
-                        audio_accumulator.write(base64.b64decode(item["audio"]))
-                    
-                    yield f"data: {json.dumps(item)}\n\n"
-                except queue.Empty:
-                    yield f"data: {json.dumps({'error': 'Timeout waiting for audio'})}\n\n"
-                    break
+            for index, turn, pcm_chunks in run.results():
+                timeline.mark("first_delta")
+                pipeline = PcmPipeline([SseEncodeStage(turn=index, speaker=turn.speaker), accumulator], timeline)
+                for pcm in pcm_chunks:
+                    pcm_view = memoryview(pcm)
+                    for offset in range(0, len(pcm_view), chunk_size):
+                        yield pipeline.push(pcm_view[offset:offset + chunk_size]).event
+                yield f"data: {json.dumps({'turn_end': index, 'speaker': turn.speaker})}\n\n"
+            status = "ok"
+
+            end_event = {'is_end': True, 'usage_characters': str(run.usage_characters)}
+            if accumulator.size and ENABLE_SAVE:
+                with timeline.span("save_audio"):
+                    end_event['url'] = save_audio(accumulator.wav(request.sample_rate), OUTPUT_DIR, http_request.base_url)
+            yield f"data: {json.dumps(end_event)}\n\n"
+        except (TimeoutError, queue.Empty):
+            logger.error("Dialogue stream timed out waiting for audio")
+            yield f"data: {json.dumps({'error': 'Timeout waiting for audio'})}\n\n"
         except Exception as e:
-            logger.exception(f"Error in VD stream: {str(e)}")
+            logger.exception(f"Error in dialogue stream: {str(e)}")
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
-    
-    return StreamingResponse(generate(), media_type="text/event-stream")
+        finally:
+            run.close()
+            recorder.record(timeline.finish(status))
+        yield f"data: {json.dumps({'timing': timeline.to_dict()})}\n\n"
+
+    return StreamingResponse(ticket.wrap(generate()), media_type="text/event-stream",
+                             headers={"X-Request-Id": timeline.request_id}, background=BackgroundTask(ticket.release))
 
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(
         app,
         host=settings.get('server.host', '0.0.0.0'),
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 class TTSRequest(BaseModel):
     text: str
@@ -10,4 +10,51 @@ class TTSRequest(BaseModel):
     speech_rate: Optional[float] = 1.0
     volume: Optional[float] = 50
     pitch_rate: Optional[float] = 1.0
+    output_sample_rate: Optional[int] = None  # Resampling der Ausgabe, z.B. 16000 oder 8000
+    return_url: Optional[bool] = False
+
+
+
+class TextStreamRequest(BaseModel):
+    # First NDJSON line of /tts_text_stream; the text follows in {"text": ...} lines
+    model: str
+    voice: Optional[str] = 'Cherry'
+    language_type: Optional[str] = 'Auto'
+    sample_rate: Optional[int] = 24000
+    speech_rate: Optional[float] = 1.0
+    volume: Optional[float] = 50
+    pitch_rate: Optional[float] = 1.0
+    output_sample_rate: Optional[int] = None
+    text: Optional[str] = ''
+    expected_characters: Optional[int] = None  # cost estimate for rate limiting
+
+class SegmentWarmupRequest(BaseModel):
+    model: str
+    phrases: List[str]
+    voice: Optional[str] = 'Cherry'
+    language_type: Optional[str] = 'Auto'
+    sample_rate: Optional[int] = 24000
+    speech_rate: Optional[float] = 1.0
+    volume: Optional[float] = 50
+    pitch_rate: Optional[float] = 1.0
+
+
+class DialogueTurn(BaseModel):
+    text: str
+    voice: str
+    speaker: Optional[str] = None
+    model: Optional[str] = None  # default: derived from the voice (Voice Design / Voice Cloning) or the request model
+    language_type: Optional[str] = 'Auto'
+    speech_rate: Optional[float] = 1.0
+    volume: Optional[float] = 50
+    pitch_rate: Optional[float] = 1.0
+    gap_ms: Optional[int] = Field(None, ge=0, le=60000)  # pause before this turn, overrides the request gap_ms
+
+
+class DialogueRequest(BaseModel):
+    turns: List[DialogueTurn]
+    model: Optional[str] = 'qwen3-tts-flash-realtime'
+    sample_rate: Optional[int] = 24000
+    gap_ms: Optional[int] = Field(300, ge=0, le=60000)
+    max_parallel: Optional[int] = Field(None, ge=1)
     return_url: Optional[bool] = False
@@ -0,0 +1,273 @@
+import json
+import math
+import struct
+import operator
+import base64
+import binascii
+from array import array
+
+
+def decode_delta(b64):
+    """
+    Decode one base64 audio delta. This is the only copy of the samples on the way through the service.
+    """
+    return binascii.a2b_base64(b64)
+
+
+class PcmChunk:
+    """
+    One audio delta moving through the pipeline. pcm is a memoryview over the decoded samples;
+    b64 keeps the upstream encoding as long as no stage has changed the audio, so it can be re-sent as is.
+    """
+    __slots__ = ("pcm", "b64", "event")
+
+    def __init__(self, pcm, b64=None):
+        self.pcm = memoryview(pcm)
+        self.b64 = b64
+        self.event = None
+
+
+class Stage:
+    # Stages with a name are timed as a span of that name on the request timeline
+    name = None
+
+    def process(self, chunk):
+        return chunk
+
+    def flush(self):
+        return []
+
+    def finish(self):
+        pass
+
+
+PHASES = 32
+
+# math.sumprod needs Python 3.12
+_dot = getattr(math, "sumprod", None) or (lambda a, b: sum(map(operator.mul, a, b)))
+
+
+def lowpass_phases(cutoff, half_width=23, phases=PHASES):
+    """
+    Hamming-windowed sinc low-pass sampled at fractional offsets 0, 1/phases, ...; cutoff is a fraction
+    of the input sample rate. Each phase has 2 * half_width + 2 taps and unity gain at DC.
+    """
+    table = []
+    for phase in range(phases):
+        fraction = phase / phases
+        taps = []
+        for k in range(2 * half_width + 2):
+            x = k - half_width - fraction
+            ideal = 2 * cutoff if x == 0 else math.sin(2 * math.pi * cutoff * x) / (math.pi * x)
+            taps.append(ideal * (0.54 + 0.46 * math.cos(math.pi * x / (half_width + 1))))
+        total = sum(taps)
+        table.append([tap / total for tap in taps])
+    return table
+
+
+class ResampleStage(Stage):
+    """
+    Resampler for 16-bit mono PCM. Upsampling interpolates linearly; downsampling evaluates a windowed-sinc
+    low-pass below the new Nyquist frequency at each output position (polyphase), so high frequencies do
+    not alias. Input history is carried over so the output is continuous across chunk boundaries.
+    """
+    name = "resample"
+
+    def __init__(self, from_rate, to_rate, half_width=23):
+        self.step = from_rate / to_rate
+        self._last = None
+        self.phases = None
+        self._position = 0.0
+        if to_rate < from_rate:
+            self.half_width = half_width
+            self.phases = lowpass_phases(0.45 * to_rate / from_rate, half_width)
+            # Silence before the first sample, so the first output is centred on it
+            self._history = [0] * half_width
+            self._position = float(half_width)
+
+    def process(self, chunk):
+        samples = array('h')
+        samples.frombytes(chunk.pcm[:len(chunk.pcm) & ~1])
+        out = self._filter(samples) if self.phases else self._interpolate(samples)
+        if not out:
+            return None
+        chunk.pcm = memoryview(out.tobytes())
+        chunk.b64 = None
+        return chunk
+
+    def flush(self):
+        if not self.phases:
+            return []
+        # Pad with silence so the outputs still waiting for future samples are produced
+        out = self._filter([0] * (self.half_width + 1))
+        return [PcmChunk(out.tobytes())] if out else []
+
+    def _filter(self, samples):
+        buffer = self._history
+        buffer.extend(samples)
+        half_width = self.half_width
+        out = array('h')
+        position = self._position
+        while int(position) + half_width + 1 < len(buffer):
+            index = int(position)
+            taps = self.phases[int((position - index) * PHASES)]
+            value = _dot(taps, buffer[index - half_width:index + half_width + 2])
+            out.append(max(-32768, min(32767, round(value))))
+            position += self.step
+        start = int(position) - half_width
+        self._history = buffer[start:]
+        self._position = position - start
+        return out
+
+    def _interpolate(self, samples):
+        if self._last is not None:
+            samples.insert(0, self._last)
+        elif not samples:
+            return None
+        out = array('h')
+        position = self._position
+        last_index = len(samples) - 1
+        while position < last_index:
+            index = int(position)
+            fraction = position - index
+            out.append(int(samples[index] + (samples[index + 1] - samples[index]) * fraction))
+            position += self.step
+        self._position = position - last_index
+        self._last = samples[-1]
+        return out
+
+
+class AccumulateStage(Stage):
+    """
+    Keeps references to the chunks for the WAV file; the audio is never concatenated.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def process(self, chunk):
+        self.chunks.append(chunk.pcm)
+        self.size += len(chunk.pcm)
+        return chunk
+
+    def wav(self, sample_rate=24000):
+        return WavChunks(self.chunks, sample_rate)
+
+
+class SseEncodeStage(Stage):
+    """
+    Render each chunk as an SSE audio event. The upstream base64 is reused when the audio is unchanged,
+    and the event is assembled around it instead of running the large string through json.dumps.
+    """
+    name = "encode"
+
+    def __init__(self, **fields):
+        extra = json.dumps(fields)[1:-1] if fields else ""
+        self._suffix = f', {extra}, "is_end": false}}\n\n' if extra else ', "is_end": false}\n\n'
+
+    def process(self, chunk):
+        b64 = chunk.b64 if chunk.b64 is not None else base64.b64encode(chunk.pcm).decode()
+        chunk.event = 'data: {"audio": "' + b64 + '"' + self._suffix
+        return chunk
+
+
+class PersistStage(Stage):
+    """
+    Saves the accumulated audio as WAV when the pipeline finishes.
+    """
+    name = "save_audio"
+
+    def __init__(self, accumulator, save, sample_rate=24000):
+        self.accumulator = accumulator
+        self.save = save
+        self.sample_rate = sample_rate
+        self.url = None
+
+    def finish(self):
+        if self.accumulator.size:
+            self.url = self.save(self.accumulator.wav(self.sample_rate))
+
+
+class PcmPipeline:
+    """
+    Runs audio deltas through a chain of stages (resample, encode, accumulate, persist, ...).
+    Every stage receives the same chunk object; a stage may replace chunk.pcm or drop the chunk by returning None.
+    """
+    def __init__(self, stages, timeline=None):
+        self.stages = stages
+        self.timeline = timeline
+
+    def push_b64(self, b64):
+        if self.timeline:
+            with self.timeline.span("decode"):
+                pcm = decode_delta(b64)
+        else:
+            pcm = decode_delta(b64)
+        return self.push(pcm, b64)
+
+    def push(self, pcm, b64=None):
+        return self._run(PcmChunk(pcm, b64), 0)
+
+    def close(self):
+        """
+        Flush buffered audio through the remaining stages, then let every stage finish.
+        Returns the chunks that came out of the flush.
+        """
+        out = []
+        for index, stage in enumerate(self.stages):
+            for chunk in stage.flush():
+                chunk = self._run(chunk, index + 1)
+                if chunk is not None:
+                    out.append(chunk)
+        for stage in self.stages:
+            if self.timeline and stage.name:
+                with self.timeline.span(stage.name):
+                    stage.finish()
+            else:
+                stage.finish()
+        return out
+
+    def _run(self, chunk, start):
+        for stage in self.stages[start:]:
+            if self.timeline and stage.name:
+                with self.timeline.span(stage.name):
+                    chunk = stage.process(chunk)
+            else:
+                chunk = stage.process(chunk)
+            if chunk is None:
+                return None
+        return chunk
+
+
+def wav_header(data_size, sample_rate=24000, channels=1, sample_width=2):
+    byte_rate = sample_rate * channels * sample_width
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 1, channels, sample_rate,
+        byte_rate, channels * sample_width, sample_width * 8, b'data', data_size
+    )
+
+
+class WavChunks:
+    """
+    A WAV file as its header followed by the PCM chunks, written or sent piece by piece.
+    """
+    def __init__(self, chunks, sample_rate=24000, channels=1, sample_width=2):
+        self.chunks = chunks
+        data_size = sum(len(chunk) for chunk in chunks)
+        self.header = wav_header(data_size, sample_rate, channels, sample_width)
+        self.size = len(self.header) + data_size
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        yield self.header
+        yield from self.chunks
+
+    async def stream(self):
+        for part in self:
+            yield part
+
+    def tobytes(self):
+        return b"".join(self)
@@ -0,0 +1,65 @@
+import time
+import threading
+from config import settings, logger
+
+RETRY_SECONDS = float(settings.get("readiness.retrySeconds", 10))
+
+
+class Readiness:
+    """
+    Startup checks that gate /ready. Checks run once in a background thread and failed checks
+    are retried, so the service only reports ready after all of them have passed.
+    """
+    def __init__(self):
+        self._checks = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def run(self, name, check):
+        with self._lock:
+            self._checks[name] = {"status": "running", "attempts": self._checks.get(name, {}).get("attempts", 0) + 1}
+        t0 = time.perf_counter()
+        try:
+            check()
+        except Exception as e:
+            logger.error(f"Readiness check {name} failed: {str(e)}")
+            with self._lock:
+                self._checks[name].update(status="failed", error=str(e))
+            return False
+        with self._lock:
+            self._checks[name].update(status="ok", duration_ms=round((time.perf_counter() - t0) * 1000, 2))
+        logger.info(f"Readiness check {name} passed")
+        return True
+
+    def run_all(self, checks, retry_seconds=RETRY_SECONDS):
+        with self._lock:
+            for name, _ in checks:
+                self._checks.setdefault(name, {"status": "pending", "attempts": 0})
+        pending = list(checks)
+        while True:
+            pending = [(name, check) for name, check in pending if not self.run(name, check)]
+            if not pending:
+                break
+            time.sleep(retry_seconds)
+        logger.info(f"Service ready after {time.time() - self.started:.2f}s")
+
+    def start(self, checks):
+        threading.Thread(target=self.run_all, args=(checks,), name="readiness", daemon=True).start()
+
+    def is_ready(self):
+        with self._lock:
+            return self._all_ok()
+
+    def status(self):
+        with self._lock:
+            return {
+                "ready": self._all_ok(),
+                "uptime_s": round(time.time() - self.started, 2),
+                "checks": {name: dict(check) for name, check in self._checks.items()},
+            }
+
+    def _all_ok(self):
+        return bool(self._checks) and all(c["status"] == "ok" for c in self._checks.values())
+
+
+readiness = Readiness()
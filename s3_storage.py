@@ -0,0 +1,61 @@
+import uuid
+import boto3
+from config import settings, logger
+
+
+class S3Backend:
+    """
+    Storage backend for storageType s3. The client is created once and reused across requests.
+    """
+    def __init__(self):
+        self.bucket = settings.get("s3.bucket")
+        self.endpoint = settings.get("s3.endpoint")
+        self.region = settings.get("s3.region")
+        self.public_url_prefix = settings.get("s3.publicUrlPrefix")
+        self.url_type = settings.get("s3.urlType", "private").lower()
+        self.expires_in = settings.get("s3.expiresIn", 3600)
+        self.client = boto3.client(
+            's3',
+            aws_access_key_id=settings.get("s3.accessKeyId"),
+            aws_secret_access_key=settings.get("s3.accessKeySecret"),
+            endpoint_url=self.endpoint if self.endpoint else None,
+            region_name=self.region if self.region else None,
+            config=boto3.session.Config(signature_version='s3v4') if self.url_type == "private" else None
+        )
+
+    def save(self, wav_audio_data, output_dir=None, base_url=None):
+        """
+        Save WAV audio data to S3 and return the URL.
+        """
+        logger.debug(f"Saving audio to S3: bucket={self.bucket}, url_type={self.url_type}")
+        file_name = f"{uuid.uuid4()}.wav"
+
+        upload_args = {
+            "Bucket": self.bucket,
+            "Key": file_name,
+            # put_object needs a contiguous body
+            "Body": wav_audio_data if isinstance(wav_audio_data, bytes) else wav_audio_data.tobytes(),
+            "ContentType": 'audio/wav'
+        }
+
+        try:
+            self.client.put_object(**upload_args)
+            logger.debug(f"File uploaded to S3: {file_name}")
+        except Exception as e:
+            logger.exception(f"Failed to upload to S3: {str(e)}")
+            raise
+
+        if self.url_type == "private":
+            return self.client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': self.bucket, 'Key': file_name},
+                ExpiresIn=self.expires_in
+            )
+
+        if self.public_url_prefix:
+            return f"{self.public_url_prefix.rstrip('/')}/{file_name}"
+        if self.endpoint:
+            # For S3 compatible services, the URL structure might be different
+            # Default to path-style if endpoint is provided
+            return f"{self.endpoint.rstrip('/')}/{self.bucket}/{file_name}"
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{file_name}"
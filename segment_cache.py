@@ -0,0 +1,334 @@
+import re
+import queue
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import settings, logger
+from callbacks import SSECallback
+from synthesis import start_session, iter_pcm
+
+SEGMENT_SPLIT = re.compile(r'(?<=[.!?])\s+|(?<=[。！？])|\n+')
+
+
+def split_segments(text):
+    """
+    Split text into sentence-level segments that are cached independently.
+    """
+    return [segment.strip() for segment in SEGMENT_SPLIT.split(text) if segment and segment.strip()]
+
+
+def segment_key(model, params, text):
+    return (model,) + tuple(params[name] for name in sorted(params)) + (text,)
+
+
+def pcm_size(chunks):
+    return sum(len(chunk) for chunk in chunks)
+
+
+class SegmentCache:
+    """
+    LRU cache of synthesized PCM per (model, voice, params, segment text), bounded by total bytes.
+    Each entry is the tuple of decoded chunks of the segment, as they came from the upstream.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_characters = 0
+
+    def get(self, key):
+        with self._lock:
+            chunks = self._entries.get(key)
+            if chunks is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_characters += len(key[-1])
+            return chunks
+
+    def put(self, key, chunks):
+        chunks = tuple(chunks)
+        size = pcm_size(chunks)
+        if not size or size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= pcm_size(old)
+            self._entries[key] = chunks
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= pcm_size(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "saved_characters": self.saved_characters,
+            }
+
+
+def crossfade(tail, head):
+    """
+    Linearly crossfade the end of one 16-bit PCM segment into the start of the next.
+    Returns [tail before the overlap, mix, head after the overlap] as slices around the mixed samples;
+    the overlapping region is replaced by the mix, so the output is shorter by the overlap.
+    """
+    tail, head = memoryview(tail), memoryview(head)
+    n = min(len(tail), len(head)) // 2
+    if n == 0:
+        return [tail, memoryview(b""), head]
+    a = array('h')
+    a.frombytes(tail[len(tail) - n * 2:])
+    b = array('h')
+    b.frombytes(head[:n * 2])
+    mixed = array('h', (int(a[i] + (b[i] - a[i]) * (i + 1) / (n + 1)) for i in range(n)))
+    return [tail[:len(tail) - n * 2], memoryview(mixed.tobytes()), head[n * 2:]]
+
+
+class PcmAssembler:
+    """
+    Join PCM segments incrementally with short crossfades. Only the last fade window of output
+    is held back until the next segment (or flush) decides how it is mixed; everything before it
+    is passed on as slices of the input chunks.
+    """
+    def __init__(self, sample_rate=24000, fade_ms=10, sample_width=2):
+        self.fade_bytes = int(sample_rate * fade_ms / 1000) * sample_width
+        self._tail = memoryview(b"")
+        self._head = []
+        self._joining = False
+
+    def start_segment(self):
+        if self._joining:
+            # The previous segment was shorter than the fade window; it becomes part of the tail
+            self._tail = memoryview(b"".join(self._join()))
+        self._joining = bool(self._tail)
+
+    def push(self, pcm):
+        """
+        Return the chunks of output that are final now.
+        """
+        pcm = memoryview(pcm)
+        out = []
+        if self._joining:
+            self._head.append(pcm)
+            if pcm_size(self._head) < self.fade_bytes:
+                return out
+            before, self._tail, pcm = self._join()
+            out.append(before)
+        if len(pcm) < self.fade_bytes:
+            # Too short to hold back the window on its own: merge it with the (equally short) tail
+            pcm = memoryview(bytes(self._tail) + bytes(pcm))
+            self._tail = memoryview(b"")
+        out.append(self._tail)
+        split = max(0, len(pcm) - self.fade_bytes) & ~1
+        out.append(pcm[:split])
+        self._tail = pcm[split:]
+        return [chunk for chunk in out if len(chunk)]
+
+    def flush(self):
+        chunks = self._join() if self._joining else [self._tail]
+        self._tail = memoryview(b"")
+        return [chunk for chunk in chunks if len(chunk)]
+
+    def _join(self):
+        head = self._head[0] if len(self._head) == 1 else b"".join(self._head)
+        chunks = crossfade(self._tail, head)
+        self._tail = memoryview(b"")
+        self._head = []
+        self._joining = False
+        return chunks
+
+
+class SegmentJob:
+    """
+    Synthesizes one uncached segment in its own upstream session. run() occupies its worker until the
+    session has ended, so the executor size bounds the concurrent upstream sessions; the decoded PCM is
+    handed over to chunks() as it arrives and cached once the segment is complete, even if nobody reads it.
+    """
+    def __init__(self, model, params, text, key, timeline=None):
+        self.model = model
+        self.params = params
+        self.text = text
+        self.key = key
+        self.timeline = timeline
+        self.callback = SSECallback(timeline)
+        self.output = queue.Queue()
+        self.started = threading.Event()
+        self.pcm = None
+
+    def run(self, timeout=30):
+        self.started.set()
+        try:
+            start_session(self.model, self.callback, self.params, self.text, self.timeline)
+            collected = []
+            for pcm in iter_pcm(self.callback, self.timeline, timeout):
+                collected.append(pcm)
+                self.output.put(pcm)
+            self.pcm = tuple(collected)
+            segment_cache.put(self.key, self.pcm)
+        except queue.Empty as e:
+            logger.error("SegmentJob: timed out waiting for audio")
+            self.output.put(e)
+        except Exception as e:
+            logger.exception(f"SegmentJob: synthesis failed: {str(e)}")
+            self.output.put(e)
+        finally:
+            self.output.put(None)
+
+    def chunks(self, timeout=30):
+        """
+        Yield the PCM of this segment; raises queue.Empty on timeout and the job's error if it failed.
+        The timeout only starts once the job is running, not while it waits for a free worker.
+        """
+        if self.pcm is not None:
+            yield from self.pcm
+            return
+        self.started.wait()
+        while True:
+            item = self.output.get(timeout=timeout)
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    @property
+    def usage_characters(self):
+        return int(self.callback.usage_characters or 0)
+
+
+class SegmentPlan:
+    """
+    Resolve the segments of one request against the cache and synthesize only the missing ones,
+    concurrently and ahead of playback, while the output is assembled in order.
+    """
+    def __init__(self, model, params, text, timeline=None):
+        self.segments = []
+        self.jobs = []
+        self._futures = []
+        self.saved_characters = 0
+        pending = {}
+        for segment in split_segments(text):
+            key = segment_key(model, params, segment)
+            chunks = segment_cache.get(key)
+            if chunks is not None:
+                self.segments.append(chunks)
+                self.saved_characters += len(segment)
+            elif key in pending:
+                self.segments.append(pending[key])
+            else:
+                job = SegmentJob(model, params, segment, key, timeline)
+                pending[key] = job
+                self.jobs.append(job)
+                self.segments.append(job)
+        self.sample_rate = params.get("sample_rate") or 24000
+        if timeline and self.saved_characters:
+            timeline.count("saved_characters", self.saved_characters)
+
+    def start(self):
+        self._futures = [_get_executor().submit(job.run) for job in self.jobs]
+        return self
+
+    def run(self):
+        """
+        Synthesize the missing segments one after another in the calling thread, for callers
+        that bound their upstream sessions themselves (dialogue turns).
+        """
+        for job in self.jobs:
+            job.run()
+        return self
+
+    def iter_pcm(self, timeout=30):
+        assembler = PcmAssembler(self.sample_rate, CROSSFADE_MS)
+        try:
+            for segment in self.segments:
+                assembler.start_segment()
+                chunks = segment.chunks(timeout) if isinstance(segment, SegmentJob) else segment
+                for pcm in chunks:
+                    yield from assembler.push(pcm)
+            yield from assembler.flush()
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        """
+        Drop jobs that are still waiting for a worker; running jobs finish and fill the cache.
+        """
+        for future in self._futures:
+            future.cancel()
+
+    @property
+    def usage_characters(self):
+        return sum(job.usage_characters for job in self.jobs)
+
+
+def warmup(model, params, phrases):
+    """
+    Pre-populate the cache with known phrases; returns how many segments were synthesized.
+    """
+    synthesized = 0
+    for phrase in phrases:
+        plan = SegmentPlan(model, params, phrase).start()
+        for _ in plan.iter_pcm():
+            pass
+        synthesized += len(plan.jobs)
+    return synthesized
+
+
+SEGMENT_CACHE_ENABLED = settings.get("segmentCache.enabled", False)
+if isinstance(SEGMENT_CACHE_ENABLED, str):
+    SEGMENT_CACHE_ENABLED = SEGMENT_CACHE_ENABLED.lower() == "true"
+CROSSFADE_MS = float(settings.get("segmentCache.crossfadeMs", 10))
+
+segment_cache = SegmentCache(int(settings.get("segmentCache.maxMegabytes", 256)) * 1024 * 1024)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(settings.get("segmentCache.maxParallel", 4)),
+                thread_name_prefix="segment"
+            )
+        return _executor
+
+
+warmup_done = threading.Event()
+
+
+def warmup_from_settings():
+    """
+    Pre-populate the cache from the segmentCache.warmup entries in the settings.
+    """
+    try:
+        for entry in settings.get("segmentCache.warmup", None) or []:
+            params = {
+                "voice": entry.get("voice", "Cherry"),
+                "language_type": entry.get("language_type", "Auto"),
+                "sample_rate": entry.get("sample_rate", 24000),
+                "pitch_rate": entry.get("pitch_rate", 1.0),
+                "speech_rate": entry.get("speech_rate", 1.0),
+                "volume": entry.get("volume", 50),
+            }
+            try:
+                synthesized = warmup(entry["model"], params, entry.get("phrases", []))
+                logger.info(f"Segment cache warm-up: model={entry['model']}, voice={params['voice']}, synthesized={synthesized}")
+            except Exception as e:
+                logger.error(f"Segment cache warm-up failed: {str(e)}")
+    finally:
+        warmup_done.set()
@@ -0,0 +1,34 @@
+import importlib
+import threading
+from config import settings, logger
+
+# Backends are imported on first use, so optional dependencies (e.g. boto3) are only loaded when configured.
+# Further backends register a "module:Class" target whose class implements save(wav_audio_data, output_dir, base_url).
+STORAGE_BACKENDS = {
+    "local": "local_storage:LocalBackend",
+    "s3": "s3_storage:S3Backend",
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def register_backend(name, target):
+    STORAGE_BACKENDS[name.lower()] = target
+
+
+def get_backend(name=None):
+    """
+    Return the shared instance of a storage backend, importing it on first use.
+    """
+    name = (name or settings.get("storageType", "local")).lower()
+    if name not in STORAGE_BACKENDS:
+        logger.warning(f"Unknown storage type {name}, falling back to local")
+        name = "local"
+    with _backends_lock:
+        if name not in _backends:
+            module_name, _, class_name = STORAGE_BACKENDS[name].partition(":")
+            backend_class = getattr(importlib.import_module(module_name), class_name)
+            _backends[name] = backend_class()
+            logger.info(f"Storage backend loaded: {name}")
+        return _backends[name]
@@ -0,0 +1,117 @@
+import time
+import queue
+from contextlib import nullcontext
+from config import logger
+from callbacks import HttpCallback
+from upstream import balancer
+from utils import get_dashscope_api_key
+from pcm_pipeline import decode_delta
+
+
+def session_params(request):
+    """
+    Extract the session parameters shared by all TTS request models.
+    """
+    return {
+        "voice": request.voice,
+        "language_type": request.language_type,
+        "sample_rate": request.sample_rate,
+        "pitch_rate": request.pitch_rate,
+        "speech_rate": request.speech_rate,
+        "volume": request.volume,
+    }
+
+
+def open_session(model, callback, params, timeline=None, mode='server_commit'):
+    """
+    Connect an upstream realtime session on the endpoint picked by the balancer and configure it.
+    Returns (session, lease); the lease is released through the callback when the session ends.
+    """
+    from dashscope.audio.qwen_tts_realtime import QwenTtsRealtime, AudioFormat
+    lease = balancer.acquire()
+    callback.upstream = lease
+    qwen_tts_realtime = QwenTtsRealtime(
+        model=model,
+        callback=callback,
+        url=lease.endpoint.url
+    )
+    callback.session = qwen_tts_realtime
+    # Set explicitly: the SDK may still be loading in the background when the first request arrives
+    qwen_tts_realtime.apikey = lease.endpoint.api_key or get_dashscope_api_key()
+    logger.debug(f"Opening session: endpoint={lease.endpoint.name}, model={model}, voice={params.get('voice')}, mode={mode}")
+    try:
+        t0 = time.perf_counter()
+        with _span(timeline, "connect"):
+            qwen_tts_realtime.connect()
+        lease.connected((time.perf_counter() - t0) * 1000)
+        with _span(timeline, "update_session"):
+            qwen_tts_realtime.update_session(
+                response_format=AudioFormat.PCM_24000HZ_MONO_16BIT,
+                mode=mode,
+                **params,
+            )
+    except Exception as e:
+        lease.release(error=str(e))
+        raise
+    return qwen_tts_realtime, lease
+
+
+def start_session(model, callback, params, text, timeline=None):
+    """
+    Open an upstream realtime session, send the text and finish the input.
+    Audio arrives asynchronously through the callback.
+    """
+    qwen_tts_realtime, lease = open_session(model, callback, params, timeline)
+    logger.debug(f"Starting session: text={text[:50]}...")
+    try:
+        with _span(timeline, "append_text"):
+            qwen_tts_realtime.append_text(text)
+            qwen_tts_realtime.finish()
+        lease.sent()
+    except Exception as e:
+        lease.release(error=str(e))
+        raise
+    return qwen_tts_realtime
+
+
+def _span(timeline, name):
+    return timeline.span(name) if timeline else nullcontext()
+
+
+def synthesize_pcm(model, params, text, timeline=None, timeout=60):
+    """
+    Synthesize text in a single upstream session and return (pcm_chunks, usage_characters).
+    """
+    callback = HttpCallback(timeline)
+    start_session(model, callback, params, text, timeline)
+    if not callback.wait_for_finished(timeout=timeout):
+        callback.abort("timeout")
+        raise TimeoutError("TTS synthesis timed out")
+    if callback.error_msg:
+        raise RuntimeError(f"TTS synthesis error: {callback.error_msg}")
+    return callback.accumulator.chunks, int(callback.usage_characters or 0)
+
+
+def iter_pcm(callback, timeline=None, timeout=30):
+    """
+    Yield decoded PCM chunks from an SSECallback queue until the session ends.
+    Raises queue.Empty on timeout (after aborting the session) and RuntimeError on upstream errors.
+    """
+    while True:
+        try:
+            item = callback.queue.get(timeout=timeout)
+        except queue.Empty:
+            callback.abort("timeout")
+            raise
+        if item is None:
+            break
+        if "error" in item:
+            raise RuntimeError(item["error"])
+        if timeline:
+            with timeline.span("decode"):
+                pcm = decode_delta(item["audio"])
+        else:
+            pcm = decode_delta(item["audio"])
+        yield pcm
+    if callback.error_msg:
+        raise RuntimeError(callback.error_msg)
@@ -0,0 +1,67 @@
+"""
+AdmissionScheduler slot accounting when waiting requests time out or are cancelled.
+
+    python -m pytest -q test_admission.py
+"""
+import asyncio
+
+from admission import AdmissionScheduler, ClientState, Ticket
+
+
+def ticket(scheduler, client, cost=100):
+    return Ticket(scheduler, client, "qwen3-tts-flash-realtime", cost, 1, None)
+
+
+def test_cancelled_waiter_does_not_keep_a_slot():
+    async def scenario():
+        scheduler = AdmissionScheduler(max_sessions=1, aging_characters_per_second=0)
+        client = ClientState("client", 0, 0, 4)
+        blocker = ticket(scheduler, client)
+        assert await scheduler.acquire(blocker, 1)
+        waiter = ticket(scheduler, client)
+        task = asyncio.create_task(scheduler.acquire(waiter, 10))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        scheduler.release(blocker)
+        await asyncio.sleep(0.01)
+        return scheduler, client, waiter
+
+    scheduler, client, waiter = asyncio.run(scenario())
+    assert waiter.cancelled and not waiter.granted
+    assert scheduler.active == 0 and client.active == 0 and client.queued == 0
+
+
+def test_cancelled_after_grant_releases_the_slot():
+    async def scenario():
+        scheduler = AdmissionScheduler(max_sessions=1, aging_characters_per_second=0)
+        client = ClientState("client", 0, 0, 4)
+        blocker = ticket(scheduler, client)
+        assert await scheduler.acquire(blocker, 1)
+        waiter = ticket(scheduler, client)
+        task = asyncio.create_task(scheduler.acquire(waiter, 10))
+        await asyncio.sleep(0.01)
+        # Granted from another thread while the waiter is being cancelled
+        scheduler.release(blocker)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return scheduler, client, waiter
+
+    scheduler, client, waiter = asyncio.run(scenario())
+    assert waiter.granted and waiter.released
+    assert scheduler.active == 0 and client.active == 0
+
+
+def test_timed_out_waiter_is_skipped():
+    async def scenario():
+        scheduler = AdmissionScheduler(max_sessions=1, aging_characters_per_second=0)
+        client = ClientState("client", 0, 0, 4)
+        blocker = ticket(scheduler, client)
+        assert await scheduler.acquire(blocker, 1)
+        waiter = ticket(scheduler, client)
+        admitted = await scheduler.acquire(waiter, 0.05)
+        scheduler.release(blocker)
+        return scheduler, admitted
+
+    scheduler, admitted = asyncio.run(scenario())
+    assert not admitted and scheduler.active == 0
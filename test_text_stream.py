@@ -0,0 +1,220 @@
+"""
+/tts_text_stream against fake_upstream.py, through a real uvicorn server so the request body
+and the SSE response are streamed on the same connection at the same time.
+
+    python -m pytest -q test_text_stream.py
+"""
+import json
+import time
+import socket
+import asyncio
+import threading
+
+import pytest
+import uvicorn
+
+import fake_upstream
+import text_stream
+from main import app
+from upstream import balancer, UpstreamEndpoint
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def server():
+    upstream_port = free_port()
+    threading.Thread(target=asyncio.run, args=(fake_upstream.serve([f"{upstream_port}:10"]),), daemon=True).start()
+    balancer.endpoints[:] = [UpstreamEndpoint("fake", f"ws://127.0.0.1:{upstream_port}", api_key="sk-test")]
+    port = free_port()
+    uvicorn_server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=uvicorn_server.run, daemon=True).start()
+    deadline = time.time() + 20
+    while not uvicorn_server.started:
+        assert time.time() < deadline, "server did not start"
+        time.sleep(0.05)
+    yield port
+    uvicorn_server.should_exit = True
+
+
+@pytest.fixture
+def commits(monkeypatch):
+    """
+    Texts committed upstream, in order.
+    """
+    committed = []
+    commit = text_stream.TextStreamSession.commit
+
+    def recording_commit(session, text):
+        commit(session, text)
+        committed.append(text)
+
+    monkeypatch.setattr(text_stream.TextStreamSession, "commit", recording_commit)
+    return committed
+
+
+class DuplexClient:
+    """
+    Minimal HTTP/1.1 client that sends a chunked NDJSON body while reading the SSE response.
+    """
+    def __init__(self, port):
+        self.sock = socket.create_connection(("127.0.0.1", port), timeout=10)
+        self.sock.sendall(b"POST /tts_text_stream HTTP/1.1\r\nHost: test\r\nContent-Type: application/x-ndjson\r\n"
+                          b"Transfer-Encoding: chunked\r\n\r\n")
+        self.reader = self.sock.makefile("rb")
+        self._events = None
+
+    def send_raw(self, data):
+        self.sock.sendall(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    def send(self, message):
+        self.send_raw((json.dumps(message) + "\n").encode())
+
+    def end(self):
+        self.sock.sendall(b"0\r\n\r\n")
+
+    def events(self):
+        if self._events is None:
+            self._events = self._read_events()
+        return self._events
+
+    def _read_events(self):
+        status = self.reader.readline()
+        assert b" 200 " in status, status
+        while self.reader.readline().strip():
+            pass
+        buffer = b""
+        while True:
+            size = int(self.reader.readline().strip() or b"0", 16)
+            if not size:
+                return
+            buffer += self.reader.read(size + 2)[:-2]
+            *events, buffer = buffer.split(b"\n\n")
+            for event in events:
+                if event.startswith(b"data: "):
+                    yield json.loads(event[len(b"data: "):])
+
+    def rest(self):
+        return list(self.events())
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not met in time"
+        time.sleep(0.02)
+
+
+def released():
+    return all(endpoint.in_flight == 0 for endpoint in balancer.endpoints)
+
+
+def test_sentence_buffer_merges_short_sentences_and_waits_for_boundaries():
+    buffer = text_stream.SentenceBuffer(min_characters=20, max_characters=60)
+    assert buffer.push("Hi. Ok. Pi ist 3.") == []
+    assert buffer.push("14 und das ist gut! Rest") == ["Hi. Ok. Pi ist 3.14 und das ist gut!"]
+    assert buffer.flush() == ["Rest"]
+    assert buffer.push("ein sehr langer Satz ohne Satzende, der immer weiter und weiter geht") == \
+        ["ein sehr langer Satz ohne Satzende, der immer weiter und"]
+
+
+def test_sentence_buffer_keeps_cjk_text_as_is():
+    buffer = text_stream.SentenceBuffer(min_characters=10, max_characters=60)
+    assert buffer.push("你好。我是小明。") == []
+    assert buffer.push("今天天气很好。") == ["你好。我是小明。今天天气很好。"]
+    assert buffer.flush() == []
+
+
+def test_audio_arrives_before_body_is_complete(server, commits):
+    client = DuplexClient(server)
+    try:
+        client.send({"model": "qwen3-tts-flash-realtime", "voice": "Cherry"})
+        client.send({"text": "Das ist der erste vollständige Satz. "})
+        events = client.events()
+        first = next(events)
+        # The body is still open: the first sentence was synthesized on its own
+        assert "audio" in first
+        assert commits == ["Das ist der erste vollständige Satz."]
+        client.send({"text": "Und hier kommt der zweite Satz."})
+        client.end()
+        rest = client.rest()
+    finally:
+        client.close()
+    assert not [event for event in rest if "error" in event]
+    end = next(event for event in rest if event.get("is_end"))
+    assert int(end["usage_characters"]) == sum(len(text) for text in commits)
+    assert commits == ["Das ist der erste vollständige Satz.", "Und hier kommt der zweite Satz."]
+    wait_for(released)
+
+
+def test_short_sentences_are_merged_and_flush_commits_immediately(server, commits):
+    client = DuplexClient(server)
+    try:
+        client.send({"model": "qwen3-tts-flash-realtime"})
+        for text in ["Hi. ", "Ok. ", "Das ist ein Satz. "]:
+            client.send({"text": text})
+        wait_for(lambda: len(commits) == 1)
+        assert commits == ["Hi. Ok. Das ist ein Satz."]
+        client.send({"text": "Ohne Satzende"})
+        client.send({"flush": True})
+        # Committed while the body is still open
+        wait_for(lambda: len(commits) == 2)
+        assert commits[1] == "Ohne Satzende"
+        client.end()
+        rest = client.rest()
+    finally:
+        client.close()
+    assert not [event for event in rest if "error" in event]
+    assert len(commits) == 2
+    wait_for(released)
+
+
+@pytest.mark.parametrize("lines, error", [
+    ([b'{"text": "Ein Satz, der noch offen ist"}\n', b"kein json\n"], "Invalid NDJSON line"),
+    ([b'["keine", "Objekte"]\n'], "NDJSON lines must be objects"),
+    ([], "Text stream contained no text"),
+])
+def test_invalid_or_empty_stream_ends_with_error(server, commits, lines, error):
+    errors_before = sum(endpoint.errors for endpoint in balancer.endpoints)
+    client = DuplexClient(server)
+    try:
+        client.send({"model": "qwen3-tts-flash-realtime"})
+        for line in lines:
+            client.send_raw(line)
+        client.end()
+        events = client.rest()
+    finally:
+        client.close()
+    assert any(error in event.get("error", "") for event in events)
+    assert events[-2].get("is_end") and "timing" in events[-1]
+    assert commits == []
+    wait_for(released)
+    # Client-side errors do not count against the upstream endpoint
+    assert sum(endpoint.errors for endpoint in balancer.endpoints) == errors_before
+
+
+def test_client_disconnect_aborts_session(server, commits, monkeypatch):
+    aborted = []
+    abort = text_stream.TextStreamSession.abort
+
+    def recording_abort(session, error, upstream=False):
+        aborted.append(error)
+        abort(session, error, upstream)
+
+    monkeypatch.setattr(text_stream.TextStreamSession, "abort", recording_abort)
+    client = DuplexClient(server)
+    client.send({"model": "qwen3-tts-flash-realtime"})
+    client.send({"text": "Ein erster Satz, der gesprochen wird. Und ein zweiter"})
+    assert "audio" in next(client.events())
+    client.close()
+    wait_for(lambda: aborted == ["Client disconnected"])
+    wait_for(released)
+    assert commits == ["Ein erster Satz, der gesprochen wird."]
@@ -0,0 +1,158 @@
+"""
+UpstreamBalancer against several fake_upstream.py endpoints with different latencies and failure modes.
+
+    python -m pytest -q test_upstream.py
+"""
+import time
+import socket
+import asyncio
+import threading
+
+import pytest
+
+import fake_upstream
+import synthesis
+from upstream import UpstreamBalancer, UpstreamEndpoint
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+PARAMS = {"voice": "Cherry", "language_type": "Auto", "sample_rate": 24000,
+          "pitch_rate": 1.0, "speech_rate": 1.0, "volume": 50}
+FAST, SLOW, FAILING = free_port(), free_port(), free_port()
+
+
+class FakeUpstreams:
+    """
+    fake_upstream.serve() in its own event loop thread, so it can be stopped again.
+    """
+    def __init__(self, *specs):
+        self.ports = [int(spec.split(":")[0]) for spec in specs]
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(fake_upstream.serve(list(specs)))
+        threading.Thread(target=self.run, daemon=True).start()
+        for port in self.ports:
+            wait_for_port(port)
+
+    def run(self):
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+
+    def stop(self):
+        # The listening sockets close right away; open WebSocket connections are wound down in the background
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        for port in self.ports:
+            wait_for_port(port, listening=False)
+
+
+def wait_for_port(port, listening=True, timeout=5):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            if listening:
+                return
+        except OSError:
+            if not listening:
+                return
+        assert time.time() < deadline, f"fake upstream on {port} did not {'start' if listening else 'stop'}"
+        time.sleep(0.05)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def upstreams():
+    fakes = FakeUpstreams(f"{FAST}:5", f"{SLOW}:150", f"{FAILING}:5:1")
+    yield
+    fakes.stop()
+
+
+def wait_until(deadline):
+    time.sleep(max(0.0, deadline - time.time()) + 0.05)
+
+
+def endpoint(name, port, weight=1.0):
+    return UpstreamEndpoint(name, f"ws://127.0.0.1:{port}", api_key="sk-test", weight=weight)
+
+
+def use(monkeypatch, *endpoints, **options):
+    balancer = UpstreamBalancer(list(endpoints), **options)
+    monkeypatch.setattr(synthesis, "balancer", balancer)
+    return balancer
+
+
+def synthesize(voice="Cherry"):
+    try:
+        synthesis.synthesize_pcm("qwen3-tts-flash-realtime", {**PARAMS, "voice": voice}, "Hallo.", timeout=10)
+        return True
+    except Exception:
+        return False
+
+
+def test_traffic_goes_to_the_faster_endpoint(monkeypatch):
+    fast, slow = endpoint("fast", FAST), endpoint("slow", SLOW)
+    use(monkeypatch, fast, slow)
+    assert all(synthesize() for _ in range(20))
+    # Each endpoint gets measured once, then the slow one only gets traffic when the fast one is loaded
+    assert fast.requests >= 18 and slow.requests >= 1
+    assert fast.connect_ms < slow.connect_ms
+    assert fast.in_flight == slow.in_flight == 0
+
+
+def test_failing_endpoint_is_ejected_and_probed_back_in(monkeypatch):
+    port = free_port()
+    failing = FakeUpstreams(f"{port}:5:1")
+    # Weighted far above the healthy endpoint, the broken one keeps getting picked until it is ejected
+    healthy, broken = endpoint("healthy", FAST), endpoint("broken", port, weight=1000)
+    use(monkeypatch, broken, healthy, eject_after=2, eject_seconds=1)
+
+    for _ in range(5):
+        if broken.ejections:
+            break
+        synthesize()
+    assert broken.errors == 2 and broken.ejections == 1
+    requests = broken.requests
+    assert all(synthesize() for _ in range(3))
+    assert broken.requests == requests
+
+    # After the ejection expires a single probe is sent; it fails again, so the backoff doubles
+    wait_until(broken.ejected_until)
+    assert not synthesize()
+    assert broken.requests == requests + 1
+    assert broken.ejections == 2 and broken.ejected_until - time.time() > 1
+
+    # The endpoint recovers: the next probe succeeds and restores it
+    failing.stop()
+    recovered = FakeUpstreams(f"{port}:5")
+    wait_until(broken.ejected_until)
+    try:
+        assert synthesize()
+    finally:
+        recovered.stop()
+    assert broken.requests == requests + 2
+    assert broken.ejections == 0 and not broken.is_ejected(time.time())
+    assert healthy.in_flight == broken.in_flight == 0
+
+
+def test_server_errors_eject_the_endpoint(monkeypatch):
+    failing = endpoint("failing", FAILING)
+    use(monkeypatch, failing, eject_after=2, eject_seconds=30)
+    assert not synthesize() and not synthesize()
+    assert failing.errors == 2 and failing.is_ejected(time.time())
+    assert failing.in_flight == 0
+
+
+def test_request_errors_do_not_count_against_the_endpoint(monkeypatch):
+    healthy = endpoint("healthy", FAST)
+    use(monkeypatch, healthy, eject_after=2, eject_seconds=30)
+    for _ in range(5):
+        assert not synthesize(voice="invalid-voice")
+    assert healthy.requests == 5
+    assert healthy.errors == 0 and healthy.ejections == 0
+    assert healthy.in_flight == 0
+    assert synthesize()
@@ -0,0 +1,171 @@
+import json
+import asyncio
+import anyio
+from starlette.requests import ClientDisconnect
+from fastapi.responses import StreamingResponse
+from config import settings, logger
+from segment_cache import SEGMENT_SPLIT
+from synthesis import open_session, _span
+
+MIN_COMMIT_CHARACTERS = int(settings.get("textStream.minCommitCharacters", 20))
+MAX_COMMIT_CHARACTERS = int(settings.get("textStream.maxCommitCharacters", 300))
+TEXT_STREAM_IDLE_TIMEOUT = float(settings.get("textStream.idleTimeoutSeconds", 60))
+TEXT_STREAM_DEFAULT_COST = int(settings.get("textStream.defaultCostCharacters", 1000))
+
+SOFT_BREAKS = ",;:，；： "
+
+
+class SentenceBuffer:
+    """
+    Collects streamed text fragments and releases complete sentences. A sentence ends where the segment
+    cache would split (end punctuation followed by whitespace, CJK stops, newlines), so "3." in "3.14"
+    is only split once the next fragment shows what follows. Sentences shorter than min_characters are
+    joined with the next one as they appear in the text, so CJK text gets no extra spaces; text without
+    a boundary is cut at max_characters on a comma or space.
+    """
+    def __init__(self, min_characters=MIN_COMMIT_CHARACTERS, max_characters=MAX_COMMIT_CHARACTERS):
+        self.min_characters = min_characters
+        self.max_characters = max_characters
+        self._text = ""
+
+    def push(self, fragment):
+        text = self._text + fragment
+        sentences = []
+        start = 0
+        for boundary in SEGMENT_SPLIT.finditer(text):
+            # Short sentences stay pending and are released together with the next boundary
+            sentence = text[start:boundary.start()].strip()
+            if len(sentence) >= self.min_characters:
+                sentences.append(sentence)
+                start = boundary.end()
+        # Whatever follows the last released sentence has no boundary yet or is still too short
+        self._text = text[start:]
+        while self.max_characters and len(self._text) > self.max_characters:
+            head = self._text[:self.max_characters]
+            cut = max(head.rfind(char) for char in SOFT_BREAKS) + 1 or self.max_characters
+            sentences.append(self._text[:cut].strip())
+            self._text = self._text[cut:].lstrip()
+        return sentences
+
+    def flush(self):
+        text, self._text = self._text.strip(), ""
+        return [text] if text else []
+
+
+class TextStreamSession:
+    """
+    Upstream session in commit mode: text is appended as it arrives and committed sentence by sentence,
+    so the first sentence is synthesized while the rest is still being generated.
+    """
+    def __init__(self, model, callback, params, timeline=None):
+        self.model = model
+        self.callback = callback
+        self.params = params
+        self.timeline = timeline
+        self.session = None
+        self.lease = None
+        self.committed = 0
+
+    def open(self):
+        self.session, self.lease = open_session(self.model, self.callback, self.params, self.timeline, mode='commit')
+
+    def commit(self, text):
+        with _span(self.timeline, "append_text"):
+            self.session.append_text(text)
+            self.session.commit()
+        if not self.committed:
+            self.lease.sent()
+        self.committed += len(text)
+        logger.debug(f"Text stream: committed {len(text)} characters ({self.committed} total)")
+
+    def finish(self):
+        self.session.finish()
+
+    def abort(self, error, upstream=False):
+        """
+        End the response with an error event; only upstream failures count against the endpoint.
+        """
+        logger.warning(f"Text stream aborted: {error}")
+        if self.lease:
+            self.lease.release(error if upstream else None)
+        self.callback.error_msg = error
+        self.callback.queue.put({"error": error})
+        self.callback.queue.put(None)
+        if self.session:
+            try:
+                self.session.close()
+            except Exception:
+                pass
+
+
+async def read_ndjson(http_request):
+    """
+    Yield one object per line of a chunked NDJSON request body as the lines arrive.
+    """
+    buffer = b""
+    async for chunk in http_request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _parse_line(line)
+    if buffer.strip():
+        yield _parse_line(buffer)
+
+
+def _parse_line(line):
+    try:
+        message = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid NDJSON line: {e}")
+    if not isinstance(message, dict):
+        raise ValueError("NDJSON lines must be objects")
+    return message
+
+
+async def feed_text(session, text, messages):
+    """
+    Open the session, then forward the initial text and every {"text": ...} line as complete sentences.
+    {"flush": true} commits the buffered text without waiting for a sentence boundary.
+    """
+    buffer = SentenceBuffer()
+
+    async def commit(sentences):
+        for sentence in sentences:
+            await anyio.to_thread.run_sync(session.commit, sentence)
+
+    try:
+        await anyio.to_thread.run_sync(session.open)
+    except Exception as e:
+        session.abort(str(e), upstream=True)
+        return
+    try:
+        await commit(buffer.push(text or ""))
+        async for message in messages:
+            if message.get("text"):
+                await commit(buffer.push(str(message["text"])))
+            if message.get("flush"):
+                await commit(buffer.flush())
+        await commit(buffer.flush())
+        if not session.committed:
+            raise ValueError("Text stream contained no text")
+        await anyio.to_thread.run_sync(session.finish)
+    except ClientDisconnect:
+        session.abort("Client disconnected")
+    except ValueError as e:
+        session.abort(str(e))
+    except asyncio.CancelledError:
+        session.abort("Response closed")
+        raise
+    except Exception as e:
+        logger.exception(f"Error in text stream: {str(e)}")
+        session.abort(str(e), upstream=True)
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    Streaming response that is sent while the request body is still being read. Starlette would otherwise
+    consume the body while listening for a disconnect; read_ndjson sees the disconnect instead.
+    """
+    async def listen_for_disconnect(self, receive):
+        await anyio.sleep_forever()
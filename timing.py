@@ -0,0 +1,232 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from config import settings, logger
+
+
+class RequestTimeline:
+    """
+    Lightweight span timeline for a single synthesis request.
+    Spans are accumulated in milliseconds, marks are offsets from the request start.
+    """
+    def __init__(self, route):
+        self.request_id = uuid.uuid4().hex[:16]
+        self.route = route
+        self.started_at = time.time()
+        self.status = "pending"
+        self.total_ms = None
+        self.spans = {}
+        self.marks = {}
+        self.counters = {}
+        self.client = None
+        self.profile = None
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - t0) * 1000)
+
+    def add(self, name, duration_ms):
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + duration_ms
+
+    def mark(self, name):
+        """
+        Record the offset of an event from the request start; only the first occurrence counts.
+        """
+        offset = (time.perf_counter() - self._start) * 1000
+        with self._lock:
+            self.marks.setdefault(name, offset)
+
+    def count(self, name, value=1):
+        """
+        Accumulate a per-request counter, e.g. upstream usage characters.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self, status="ok"):
+        if self.total_ms is None:
+            self.total_ms = (time.perf_counter() - self._start) * 1000
+            self.status = status
+        return self
+
+    def stages(self):
+        """
+        All spans and marks as one flat name -> milliseconds mapping.
+        """
+        with self._lock:
+            stages = dict(self.spans)
+            stages.update(self.marks)
+        if self.total_ms is not None:
+            stages["total"] = self.total_ms
+        return stages
+
+    def server_timing(self):
+        """
+        Render the timeline as a Server-Timing header value.
+        """
+        return ", ".join(f"{name};dur={duration:.1f}" for name, duration in self.stages().items())
+
+    def to_dict(self, include_profile=False):
+        data = {
+            "request_id": self.request_id,
+            "route": self.route,
+            "client": self.client,
+            "started_at": self.started_at,
+            "status": self.status,
+            "total_ms": round(self.total_ms, 2) if self.total_ms is not None else None,
+            "stages": {name: round(duration, 2) for name, duration in self.stages().items()},
+            "counters": dict(self.counters),
+            "profiled": self.profile is not None,
+        }
+        if include_profile and self.profile is not None:
+            data["profile"] = self.profile
+        return data
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 2)
+
+
+class TimelineRecorder:
+    """
+    Bounded in-memory ring buffer of recently finished request timelines.
+    """
+    def __init__(self, maxlen=200):
+        self._timelines = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, timeline):
+        with self._lock:
+            self._timelines.append(timeline)
+
+    def get(self, request_id):
+        with self._lock:
+            for timeline in self._timelines:
+                if timeline.request_id == request_id:
+                    return timeline
+        return None
+
+    def snapshot(self, limit=50, slowest=10):
+        with self._lock:
+            timelines = list(self._timelines)
+
+        stage_values = {}
+        for timeline in timelines:
+            for name, duration in timeline.stages().items():
+                stage_values.setdefault(name, []).append(duration)
+
+        stages = {}
+        for name, values in stage_values.items():
+            values.sort()
+            stages[name] = {
+                "count": len(values),
+                "p50": _percentile(values, 50),
+                "p90": _percentile(values, 90),
+                "p99": _percentile(values, 99),
+                "max": round(values[-1], 2),
+            }
+
+        finished = [t for t in timelines if t.total_ms is not None]
+        finished.sort(key=lambda t: t.total_ms, reverse=True)
+        return {
+            "count": len(timelines),
+            "capacity": self._timelines.maxlen,
+            "stages": stages,
+            "slowest": [t.to_dict() for t in finished[:slowest]],
+            "recent": [t.to_dict() for t in reversed(timelines[-limit:])] if limit > 0 else [],
+        }
+
+
+recorder = TimelineRecorder(int(settings.get("debug.requestBufferSize", 200)))
+
+PROFILE_HEADER = "X-Profile"
+_profile_lock = threading.Lock()
+
+
+def profiling_requested(http_request):
+    """
+    A request is profiled only when profiling is enabled in the settings and it carries the X-Profile header.
+    """
+    enabled = settings.get("debug.enableProfiling", False)
+    if isinstance(enabled, str):
+        enabled = enabled.lower() == "true"
+    if not enabled:
+        return False
+    return http_request.headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes")
+
+
+class RequestProfiler:
+    """
+    Opt-in cProfile capture of one request. Only one request is profiled at a time,
+    since the interpreter allows a single active profiler.
+    """
+    def __init__(self, timeline, requested=False):
+        self.timeline = timeline
+        self.requested = requested
+        self.profiler = None
+
+    def start(self):
+        if not self.requested:
+            return False
+        if not _profile_lock.acquire(blocking=False):
+            logger.warning(f"Profiler busy, request {self.timeline.request_id} is not profiled")
+            return False
+        self.profiler = cProfile.Profile()
+        return True
+
+    def resume(self):
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def pause(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    @contextmanager
+    def active(self):
+        self.resume()
+        try:
+            yield
+        finally:
+            self.pause()
+
+    def wrap(self, iterator):
+        """
+        Profile a generator step by step; each step may run on a different worker thread.
+        """
+        self.start()
+        try:
+            while True:
+                with self.active():
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            self.stop()
+
+    def stop(self, limit=40):
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        self.timeline.profile = out.getvalue()
+        self.profiler = None
+        _profile_lock.release()
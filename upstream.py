@@ -0,0 +1,194 @@
+import random
+import threading
+import time
+from config import settings, logger
+
+DEFAULT_URL = 'wss://dashscope-intl.aliyuncs.com/api-ws/v1/realtime'
+CUSTOMIZATION_URL = settings.get("dashscope.customizationUrl", "https://dashscope-intl.aliyuncs.com/api/v1/services/audio/tts/customization")
+EWMA_ALPHA = 0.3
+# Errors about the request itself (unknown voice, invalid parameters) say nothing about the endpoint's health
+REQUEST_ERROR_TYPES = {"invalid_request_error"}
+REQUEST_ERROR_CODES = {"InvalidParameter", "invalid_value", "BadRequest"}
+
+
+def _ewma(current, sample):
+    return sample if current is None else current + EWMA_ALPHA * (sample - current)
+
+
+def parse_error_event(response):
+    """
+    Return (message, request_error) for an upstream error event; request errors do not count against the endpoint.
+    """
+    error = response.get('error') or {}
+    if not isinstance(error, dict):
+        error = {"message": str(error)}
+    message = error.get('message') or response.get('message') or 'Unknown error'
+    request_error = error.get('type') in REQUEST_ERROR_TYPES or error.get('code') in REQUEST_ERROR_CODES
+    return message, request_error
+
+
+class UpstreamEndpoint:
+    """
+    One realtime upstream URL with its live health: EWMA latencies, error rate and in-flight sessions.
+    """
+    def __init__(self, name, url, api_key=None, weight=1.0):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.weight = max(float(weight), 0.01)
+        self.connect_ms = None
+        self.first_delta_ms = None
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.probing = False
+
+    def score(self):
+        """
+        Lower is better. Unmeasured endpoints score 0 so they receive traffic and get measured.
+        """
+        latency = (self.connect_ms or 0.0) + (self.first_delta_ms or 0.0)
+        return latency * (1 + self.in_flight) * (1 + 4 * self.error_rate) / self.weight
+
+    def is_ejected(self, now):
+        return self.ejected_until > now or (self.ejected_until > 0 and self.probing)
+
+    def stats(self, total_requests, now):
+        return {
+            "name": self.name,
+            "url": self.url,
+            "weight": self.weight,
+            "requests": self.requests,
+            "traffic_share": round(self.requests / total_requests, 4) if total_requests else 0.0,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate, 4),
+            "in_flight": self.in_flight,
+            "connect_ms": round(self.connect_ms, 2) if self.connect_ms is not None else None,
+            "first_delta_ms": round(self.first_delta_ms, 2) if self.first_delta_ms is not None else None,
+            "ejected": self.is_ejected(now),
+            "ejected_for_s": round(max(0.0, self.ejected_until - now), 1),
+        }
+
+
+class UpstreamLease:
+    """
+    Handle for one upstream session; reports its timings and outcome back to the balancer.
+    """
+    def __init__(self, balancer, endpoint):
+        self.balancer = balancer
+        self.endpoint = endpoint
+        self._sent_at = None
+        self._first_delta_seen = False
+        self._released = False
+
+    def connected(self, duration_ms):
+        with self.balancer._lock:
+            self.endpoint.connect_ms = _ewma(self.endpoint.connect_ms, duration_ms)
+
+    def sent(self):
+        self._sent_at = time.perf_counter()
+
+    def first_delta(self):
+        if self._first_delta_seen or self._sent_at is None:
+            return
+        self._first_delta_seen = True
+        duration_ms = (time.perf_counter() - self._sent_at) * 1000
+        with self.balancer._lock:
+            self.endpoint.first_delta_ms = _ewma(self.endpoint.first_delta_ms, duration_ms)
+
+    def release(self, error=None):
+        if self._released:
+            return
+        self._released = True
+        self.balancer._release(self.endpoint, error)
+
+
+class UpstreamBalancer:
+    """
+    Picks an upstream endpoint per session with power-of-two-choices on a latency/load/error score.
+    Endpoints that keep failing are ejected with exponential backoff and probed back in with a single session.
+    """
+    def __init__(self, endpoints, eject_after=3, eject_seconds=30, max_eject_seconds=300):
+        self.endpoints = endpoints
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        now = time.time()
+        with self._lock:
+            candidates = [e for e in self.endpoints if not e.is_ejected(now)]
+            if not candidates:
+                # Fail open: with every endpoint ejected, use the one that becomes available first
+                candidates = [min(self.endpoints, key=lambda e: e.ejected_until)]
+            if len(candidates) > 2:
+                weights = [e.weight for e in candidates]
+                first = random.choices(candidates, weights)[0]
+                second = random.choices(candidates, weights)[0]
+                candidates = [first, second]
+            endpoint = min(candidates, key=lambda e: e.score())
+            if endpoint.ejected_until:
+                # Ejection has expired: this session is the probe
+                endpoint.probing = True
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+        logger.debug(f"Upstream selected: {endpoint.name} ({endpoint.url})")
+        return UpstreamLease(self, endpoint)
+
+    def _release(self, endpoint, error):
+        with self._lock:
+            endpoint.in_flight = max(0, endpoint.in_flight - 1)
+            endpoint.error_rate = _ewma(endpoint.error_rate, 1.0 if error else 0.0)
+            if not error:
+                endpoint.consecutive_failures = 0
+                if endpoint.ejected_until:
+                    logger.info(f"Upstream {endpoint.name} restored after probe")
+                endpoint.ejections = 0
+                endpoint.ejected_until = 0.0
+                endpoint.probing = False
+                return
+            endpoint.errors += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.probing or endpoint.consecutive_failures >= self.eject_after:
+                endpoint.ejections += 1
+                backoff = min(self.max_eject_seconds, self.eject_seconds * 2 ** (endpoint.ejections - 1))
+                endpoint.ejected_until = time.time() + backoff
+                endpoint.probing = False
+                logger.warning(f"Upstream {endpoint.name} ejected for {backoff}s after error: {error}")
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            total = sum(e.requests for e in self.endpoints)
+            return {"endpoints": [e.stats(total, now) for e in self.endpoints]}
+
+
+def load_endpoints():
+    """
+    Endpoints from dashscope.endpoints, falling back to the single dashscope.url.
+    """
+    configured = settings.get("dashscope.endpoints", None) or []
+    endpoints = []
+    for index, entry in enumerate(configured):
+        endpoints.append(UpstreamEndpoint(
+            name=entry.get("name") or f"endpoint-{index}",
+            url=entry["url"],
+            api_key=entry.get("apiKey"),
+            weight=entry.get("weight", 1.0),
+        ))
+    if not endpoints:
+        endpoints.append(UpstreamEndpoint("default", settings.get("dashscope.url", DEFAULT_URL)))
+    return endpoints
+
+
+balancer = UpstreamBalancer(
+    load_endpoints(),
+    eject_after=int(settings.get("upstream.ejectAfterFailures", 3)),
+    eject_seconds=float(settings.get("upstream.ejectSeconds", 30)),
+    max_eject_seconds=float(settings.get("upstream.maxEjectSeconds", 300)),
+)
@@ -0,0 +1,88 @@
+import os
+import time
+import sqlite3
+import threading
+from config import settings, logger
+
+FIELDS = ("requests", "errors", "rejected", "characters", "saved_characters")
+
+
+def _period(timestamp):
+    return int(timestamp // 3600 * 3600)
+
+
+class UsageLedger:
+    """
+    Usage per client, hour and model. Requests only touch an in-memory dict;
+    the aggregates are flushed to SQLite periodically, one upsert per key.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._pending = {}
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            "client TEXT NOT NULL, period INTEGER NOT NULL, model TEXT NOT NULL, "
+            "requests INTEGER NOT NULL, errors INTEGER NOT NULL, rejected INTEGER NOT NULL, "
+            "characters INTEGER NOT NULL, saved_characters INTEGER NOT NULL, "
+            "PRIMARY KEY (client, period, model))"
+        )
+        self._db.commit()
+
+    def record(self, client, model, **counts):
+        key = (client, _period(time.time()), model or "")
+        with self._lock:
+            totals = self._pending.setdefault(key, dict.fromkeys(FIELDS, 0))
+            for name, value in counts.items():
+                totals[name] += int(value or 0)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        rows = [key + tuple(totals[name] for name in FIELDS) for key, totals in pending.items()]
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (client, period, model) DO UPDATE SET "
+                + ", ".join(f"{name} = {name} + excluded.{name}" for name in FIELDS),
+                rows
+            )
+            self._db.commit()
+        logger.debug(f"Usage: flushed {len(rows)} aggregates")
+        return len(rows)
+
+    def report(self, client=None, hours=24):
+        """
+        Totals per client and model over the last hours, including not yet flushed usage.
+        """
+        self.flush()
+        query = f"SELECT client, model, {', '.join(f'SUM({name})' for name in FIELDS)} FROM usage WHERE period >= ?"
+        params = [_period(time.time()) - (hours - 1) * 3600]
+        if client:
+            query += " AND client = ?"
+            params.append(client)
+        with self._db_lock:
+            rows = self._db.execute(query + " GROUP BY client, model", params).fetchall()
+        clients = {}
+        for row in rows:
+            totals = dict(zip(FIELDS, row[2:]))
+            entry = clients.setdefault(row[0], {"client": row[0], **dict.fromkeys(FIELDS, 0), "models": {}})
+            entry["models"][row[1]] = totals
+            for name in FIELDS:
+                entry[name] += totals[name]
+        return sorted(clients.values(), key=lambda entry: entry["characters"], reverse=True)
+
+
+USAGE_ENABLED = settings.get("usage.enabled", False)
+if isinstance(USAGE_ENABLED, str):
+    USAGE_ENABLED = USAGE_ENABLED.lower() == "true"
+FLUSH_INTERVAL = float(settings.get("usage.flushIntervalSeconds", 30))
+
+ledger = UsageLedger(settings.get("usage.database", "./usage.sqlite")) if USAGE_ENABLED else None